@@ -5,28 +5,193 @@ Assessment: FA-2 | Course: Generative AI | School: Aspee Nutan Academy
 """
 
 import streamlit as st
+import numpy as np
+from PIL import Image, ImageOps
 import google.generativeai as genai
+from google.api_core import exceptions as google_exceptions
+from fake_model import FakeModel
+import os
 import json
 import re
+import math
+import time
+import queue
+import random
+import asyncio
+import copy
+import hashlib
+import threading
+import mmap
+import struct
+import zlib
+import sqlite3
+import uuid
+import functools
+import concurrent.futures
+import csv
+import io
+from collections import OrderedDict, defaultdict, deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 from datetime import datetime
-from typing import Dict, Any, Optional
+from typing import Dict, Any, List, Optional, Callable, Iterable, Iterator, Tuple
 
 # ── PAGE CONFIG ──────────────────────────────────────────────────────────────
 st.set_page_config(page_title="AgSaathi — Smart Farming Assistant", page_icon="🌿", layout="wide", initial_sidebar_state="expanded")
 
 # ── GEMINI SETUP ────────────────────────────────────────────────────────────
-GEMINI_API_KEY = st.secrets.get("GEMINI_API_KEY", None)
-if not GEMINI_API_KEY:
+# AGSAATHI_FAKE_MODEL=1 swaps Gemini for the offline stand-in in fake_model.py (load tests, demos).
+USE_FAKE_MODEL = os.environ.get("AGSAATHI_FAKE_MODEL") == "1"
+GEMINI_API_KEY = None if USE_FAKE_MODEL else st.secrets.get("GEMINI_API_KEY", None)
+if not GEMINI_API_KEY and not USE_FAKE_MODEL:
     st.error("⚠️ Gemini API key not found. Please add GEMINI_API_KEY to your Streamlit secrets.")
     st.stop()
 
-genai.configure(api_key=GEMINI_API_KEY)
+if GEMINI_API_KEY: genai.configure(api_key=GEMINI_API_KEY)
 MODEL_NAME = "gemini-3-flash-preview" 
 MODEL_TEMPERATURE = 0.3
+MODEL_MAX_CONCURRENCY = int(os.environ.get("AGSAATHI_MODEL_CONCURRENCY", 8))
+MODEL_RATE_LIMIT_RPM = int(os.environ.get("AGSAATHI_MODEL_RPM", 60))
+MODEL_TIMEOUT_S = 60
+MODEL_MAX_RETRIES = 4
+RETRYABLE_ERRORS = (google_exceptions.ResourceExhausted, google_exceptions.TooManyRequests, google_exceptions.ServiceUnavailable,
+                    google_exceptions.InternalServerError, google_exceptions.DeadlineExceeded, asyncio.TimeoutError)
+
+class TokenBucket:
+    def __init__(self, rate_per_s: float, capacity: float):
+        self.rate, self.capacity = rate_per_s, capacity
+        self.tokens, self.updated = capacity, time.monotonic()
+
+    async def acquire(self):
+        while True:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1; return
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+class ModelClient:
+    # Mirrors GenerativeModel.generate_content for the script thread, but runs every call on
+    # one background event loop: bounded concurrency, token-bucket rate limiting, jittered
+    # exponential backoff on 429/5xx, per-call timeouts and single-flight coalescing of
+    # identical in-flight requests.
+    def __init__(self, model, concurrency: int, rpm: int, timeout: float, retries: int):
+        self.model, self.timeout, self.retries = model, timeout, retries
+        # Longest a request can legitimately take: every attempt times out, with the longest
+        # backoff in between. Callers wait this long before giving up and cancelling the call.
+        self.deadline = (retries + 1) * timeout + sum(min(30.0, 2 ** a) * 1.5 for a in range(retries))
+        self.loop = asyncio.new_event_loop()
+        threading.Thread(target=self.loop.run_forever, name="model-client", daemon=True).start()
+        self.sem = asyncio.Semaphore(concurrency)
+        self.bucket = TokenBucket(rpm / 60, max(1, concurrency))
+        self._inflight: Dict[str, Dict[str, Any]] = {}
+        self.counts = {'calls': 0, 'coalesced': 0, 'retries': 0, 'timeouts': 0, 'errors': 0}
+
+    def stats(self) -> Dict[str, Any]:
+        return {**self.counts, 'in_flight': len(self._inflight)}
+
+    def generate_content(self, contents, generation_config=None, stream: bool = False):
+        if stream: return self._stream(contents, generation_config)
+        fut = self.submit(contents, generation_config)
+        try:
+            return fut.result(timeout=self.deadline)
+        except concurrent.futures.TimeoutError:
+            fut.cancel(); raise
+
+    def submit(self, contents, generation_config=None, on_start: Optional[Callable[[], None]] = None) -> "concurrent.futures.Future":
+        # Non-blocking variant for fan-out jobs (batch mode); the script thread collects results.
+        # on_start fires when the call leaves the queue (takes a concurrency slot or joins an in-flight call).
+        return asyncio.run_coroutine_threadsafe(self._single_flight(contents, generation_config, False, on_start=on_start), self.loop)
+
+    def _stream(self, contents, generation_config) -> Iterator[Any]:
+        # Chunks are relayed through a queue; a coalesced follower receives the leader's
+        # chunks once the leader's stream has finished. Request errors raise here, before
+        # the first chunk, as they do with GenerativeModel.
+        q, done = queue.Queue(), object()
+        fut = asyncio.run_coroutine_threadsafe(self._single_flight(contents, generation_config, True, q.put), self.loop)
+        fut.add_done_callback(lambda f: q.put(done))
+        first = self._next(q, fut)
+        if first is done: fut.result()
+        return self._relay(q, fut, first, done)
+
+    def _next(self, q: "queue.Queue", fut):
+        try:
+            return q.get(timeout=self.deadline)
+        except queue.Empty:
+            fut.cancel()  # stop the call and its retries on the loop, not just the wait here
+            raise TimeoutError(f"no response from the model within {self.deadline:.0f}s")
+
+    def _relay(self, q: "queue.Queue", fut, chunk, done) -> Iterator[Any]:
+        try:
+            while chunk is not done:
+                yield chunk
+                chunk = self._next(q, fut)
+            yield from fut.result() or []
+        finally:
+            if not fut.done(): fut.cancel()  # consumer stopped early (error, rerun): free the slot
+
+    async def _single_flight(self, contents, generation_config, stream: bool, on_chunk=None, on_start=None):
+        # The shared call runs as its own task that no caller owns: a caller that gives up only
+        # stops waiting, and the call is cancelled once the last waiter has left.
+        key = hashlib.sha256(repr((contents, generation_config, stream)).encode('utf-8')).hexdigest()
+        flight, leader = self._inflight.get(key), False
+        if flight is None:
+            leader, task = True, self.loop.create_task(self._call(contents, generation_config, stream, on_chunk, on_start))
+            flight = self._inflight[key] = {'task': task, 'waiters': 0}
+            task.add_done_callback(lambda t, f=flight: self._land(key, f))
+        else:
+            self.counts['coalesced'] += 1
+            if on_start: on_start()
+        flight['waiters'] += 1
+        try:
+            res = await asyncio.shield(flight['task'])
+            return None if stream and leader else res
+        finally:
+            flight['waiters'] -= 1
+            if not flight['waiters'] and not flight['task'].done():
+                flight['task'].cancel(); self._land(key, flight)
+
+    def _land(self, key: str, flight: Dict[str, Any]):
+        if self._inflight.get(key) is flight: del self._inflight[key]
+        task = flight['task']
+        if task.done() and not task.cancelled(): task.exception()  # mark retrieved: every waiter may have left
+
+    async def _call(self, contents, generation_config, stream: bool, on_chunk, on_start=None):
+        kwargs = {'generation_config': generation_config} if generation_config is not None else {}
+        for attempt in range(self.retries + 1):
+            await self.bucket.acquire()
+            started = False
+            async with self.sem:
+                self.counts['calls'] += 1
+                if on_start and not attempt: on_start()
+                try:
+                    if not stream:
+                        return await asyncio.wait_for(self.model.generate_content_async(contents, **kwargs), self.timeout)
+                    chunks, resp = [], await asyncio.wait_for(self.model.generate_content_async(contents, stream=True, **kwargs), self.timeout)
+                    chunk_iter = resp.__aiter__()
+                    while True:  # a stalled stream must not hold its concurrency slot forever
+                        try:
+                            chunk = await asyncio.wait_for(chunk_iter.__anext__(), self.timeout)
+                        except StopAsyncIteration:
+                            return chunks
+                        started = True
+                        chunks.append(chunk); on_chunk(chunk)
+                except RETRYABLE_ERRORS as e:
+                    if isinstance(e, asyncio.TimeoutError): self.counts['timeouts'] += 1
+                    if started or attempt == self.retries:
+                        self.counts['errors'] += 1; raise
+                except Exception:
+                    self.counts['errors'] += 1; raise
+            self.counts['retries'] += 1
+            await asyncio.sleep(min(30.0, 2 ** attempt) * random.uniform(0.5, 1.5))
 
 @st.cache_resource
-def get_model():
-    return genai.GenerativeModel(model_name=MODEL_NAME, generation_config=genai.GenerationConfig(temperature=MODEL_TEMPERATURE))
+def get_model() -> ModelClient:
+    if USE_FAKE_MODEL:
+        model = FakeModel(latency=float(os.environ.get("AGSAATHI_FAKE_LATENCY", 0.5)), failure_rate=float(os.environ.get("AGSAATHI_FAKE_FAILURE_RATE", 0.0)))
+    else:
+        model = genai.GenerativeModel(model_name=MODEL_NAME, generation_config=genai.GenerationConfig(temperature=MODEL_TEMPERATURE))
+    return ModelClient(model, MODEL_MAX_CONCURRENCY, MODEL_RATE_LIMIT_RPM, MODEL_TIMEOUT_S, MODEL_MAX_RETRIES)
 
 # ── GEO DATA ────────────────────────────────────────────────────────────────
 GEO = {
@@ -35,23 +200,895 @@ GEO = {
     'Ghana 🇬🇭': {'languages': ['English'], 'states': ['Ashanti', 'Northern', 'Greater Accra', 'Volta']},
 }
 
+# Enumerable form options (shared with the precompute job in precompute.py).
+FORECAST_RISKS = ["Heatwave", "Heavy Rain / Flood", "Frost", "Drought / Dry Spell", "High Winds"]
+PRACTICES = ["Drip/Precision Irrigation", "Organic Composting System", "Crop Rotation & Cover Crops", "Zero Tillage Farming", "Solar Water Pumps"]
+WEATHER_DEFAULT_TEMP = 30
+
 # ── SESSION STATE ───────────────────────────────────────────────────────────
-DEFAULTS = {'page': 'hero', 'country': None, 'state': None, 'language': 'Hindi', 'nav': 'home', 'stats': {'queries': 0}, 'onboarding_complete': False}
+DEFAULTS = {'page': 'hero', 'country': None, 'state': None, 'language': 'Hindi', 'nav': 'home', 'stats': {'queries': 0}, 'onboarding_complete': False, 'batch': None, 'profile_checked': False, 'history_page': 0, 'results': {}}
 for k, v in DEFAULTS.items():
-    if k not in st.session_state: st.session_state[k] = v
+    if k not in st.session_state: st.session_state[k] = copy.deepcopy(v)
+
+# ── FARMER HISTORY STORE ────────────────────────────────────────────────────
+# Embedded SQLite store: onboarding choices and every tool run, keyed by an anonymous farmer id
+# carried in the URL (?farmer=...). Returning farmers skip onboarding, can page through past
+# advice and re-open it without a model call. Retention is bounded per farmer and by age.
+HISTORY_DB_PATH = os.environ.get("AGSAATHI_HISTORY_DB", "agsaathi_history.db")
+HISTORY_MAX_RUNS_PER_FARMER = 200
+HISTORY_MAX_RUNS = 200_000  # across all farmers: anonymous ids are free, so the file needs a global bound
+HISTORY_MAX_AGE_DAYS = 365
+HISTORY_COMPACT_EVERY = 500
+HISTORY_PAGE_SIZE = 10
+
+class HistoryStore:
+    def __init__(self, path: str):
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.row_factory = sqlite3.Row
+        # auto_vacuum only takes effect before the file is initialised (which switching to WAL
+        # does); files created without it need one full VACUUM to convert.
+        self._db.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        if self._db.execute("PRAGMA auto_vacuum").fetchone()[0] != 2: self._db.execute("VACUUM")
+        self._db.executescript("""
+            PRAGMA journal_mode=WAL;
+            CREATE TABLE IF NOT EXISTS farmers (farmer_id TEXT PRIMARY KEY, country TEXT, state TEXT, language TEXT, updated_at REAL);
+            CREATE TABLE IF NOT EXISTS runs (id INTEGER PRIMARY KEY AUTOINCREMENT, farmer_id TEXT NOT NULL, task TEXT NOT NULL,
+                input_key TEXT NOT NULL, inputs TEXT NOT NULL, result TEXT NOT NULL, created_at REAL NOT NULL);
+            CREATE INDEX IF NOT EXISTS idx_runs_farmer_time ON runs (farmer_id, created_at DESC);
+            CREATE INDEX IF NOT EXISTS idx_runs_lookup ON runs (farmer_id, task, input_key);
+        """)
+        self._inserts = 0
+        self.compact()
+
+    def save_profile(self, farmer_id: str, country: str, state: str, language: str):
+        with self._lock, self._db:
+            self._db.execute("INSERT OR REPLACE INTO farmers VALUES (?, ?, ?, ?, ?)", (farmer_id, country, state, language, time.time()))
+
+    def load_profile(self, farmer_id: str) -> Optional[Dict[str, str]]:
+        with self._lock:
+            row = self._db.execute("SELECT country, state, language FROM farmers WHERE farmer_id = ?", (farmer_id,)).fetchone()
+        return dict(row) if row else None
+
+    def add_run(self, farmer_id: str, task: str, input_key: str, inputs: Dict, result: Dict) -> int:
+        with self._lock, self._db:
+            run_id = self._db.execute("INSERT INTO runs (farmer_id, task, input_key, inputs, result, created_at) VALUES (?, ?, ?, ?, ?, ?)",
+                                      (farmer_id, task, input_key, json.dumps(inputs, ensure_ascii=False), json.dumps(result, ensure_ascii=False), time.time())).lastrowid
+            self._db.execute("DELETE FROM runs WHERE farmer_id = ? AND id NOT IN (SELECT id FROM runs WHERE farmer_id = ? ORDER BY created_at DESC LIMIT ?)",
+                             (farmer_id, farmer_id, HISTORY_MAX_RUNS_PER_FARMER))
+            self._inserts += 1
+        if self._inserts % HISTORY_COMPACT_EVERY == 0: self.compact()
+        return run_id
+
+    def find_run(self, farmer_id: str, task: str, input_key: str, max_age_s: float) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._db.execute("SELECT * FROM runs WHERE farmer_id = ? AND task = ? AND input_key = ? AND created_at > ? ORDER BY created_at DESC LIMIT 1",
+                                   (farmer_id, task, input_key, time.time() - max_age_s)).fetchone()
+        return self._decode(row)
+
+    def page(self, farmer_id: str, task: Optional[str], page: int, size: int = HISTORY_PAGE_SIZE) -> Tuple[List[Dict[str, Any]], int]:
+        where, args = ("farmer_id = ? AND task = ?", (farmer_id, task)) if task else ("farmer_id = ?", (farmer_id,))
+        with self._lock:
+            total = self._db.execute(f"SELECT COUNT(*) FROM runs WHERE {where}", args).fetchone()[0]
+            rows = self._db.execute(f"SELECT * FROM runs WHERE {where} ORDER BY created_at DESC LIMIT ? OFFSET ?", (*args, size, page * size)).fetchall()
+        return [self._decode(r) for r in rows], total
+
+    def recent_runs(self, farmer_id: str, task: str, limit: int = 20) -> List[Dict[str, Any]]:
+        with self._lock:
+            rows = self._db.execute("SELECT * FROM runs WHERE farmer_id = ? AND task = ? ORDER BY created_at DESC LIMIT ?", (farmer_id, task, limit)).fetchall()
+        return [self._decode(r) for r in rows]
+
+    def compact(self):
+        with self._lock, self._db:
+            cutoff = time.time() - HISTORY_MAX_AGE_DAYS * 86400
+            self._db.execute("DELETE FROM runs WHERE created_at < ?", (cutoff,))
+            self._db.execute("DELETE FROM runs WHERE id <= (SELECT id FROM runs ORDER BY id DESC LIMIT 1 OFFSET ?)", (HISTORY_MAX_RUNS,))
+            self._db.execute("DELETE FROM farmers WHERE updated_at < ? AND farmer_id NOT IN (SELECT DISTINCT farmer_id FROM runs)", (cutoff,))
+        with self._lock:
+            self._db.executescript("PRAGMA incremental_vacuum;")  # execute() would step it once, freeing a single page
+
+    @staticmethod
+    def _decode(row: Optional[sqlite3.Row]) -> Optional[Dict[str, Any]]:
+        if row is None: return None
+        return {**dict(row), 'inputs': json.loads(row['inputs']), 'result': json.loads(row['result'])}
+
+@st.cache_resource
+def get_history_store() -> HistoryStore:
+    return HistoryStore(HISTORY_DB_PATH)
+
+def get_farmer_id() -> str:
+    fid = st.query_params.get('farmer')
+    if not fid or not re.fullmatch(r'[0-9a-f]{16}', fid):
+        fid = uuid.uuid4().hex[:16]
+        st.query_params['farmer'] = fid
+    return fid
+
+def restore_profile():
+    # Returning farmers (same ?farmer= link) go straight to the dashboard.
+    st.session_state.profile_checked = True
+    profile = get_history_store().load_profile(get_farmer_id())
+    if profile and profile['country'] in GEO:
+        st.session_state.update({**profile, 'onboarding_complete': True, 'nav': 'home'})
+
+def form_key(task: str, field: str, default: Any = None) -> str:
+    # Form widgets are keyed so "re-run with changes" can prefill them from a past run.
+    key = f"{task}_{field}"
+    if default is not None: st.session_state.setdefault(key, default)
+    return key
+
+def diff_inputs(old: Dict[str, Any], new: Dict[str, Any]) -> List[str]:
+    return [k for k in new if normalize_inputs({k: old.get(k)}) != normalize_inputs({k: new[k]})]
+
+def diff_results(old: Dict[str, Any], new: Dict[str, Any]) -> List[Tuple[str, Any, Any]]:
+    return [(k, old.get(k), new.get(k)) for k in dict.fromkeys([*old, *new]) if old.get(k) != new.get(k)]
+
+# ── PROMPTS ─────────────────────────────────────────────────────────────────
+PROMPTS = {
+    'crop_rec': """Language: {language}. Location: {state}. Task: Crop Recommendation.
+        Inputs: Budget: {budget}, Water: {water}, Soil: {soil}, Season: {season}, Goal: "{goal}".
+        JSON format exactly: {{"location_analysis": "string", "suggestions": [{{"crop_name": "string", "reason": "string", "risk_level": "LOW/MEDIUM/HIGH", "market_potential": "string"}}], "confidence_score": 0-100}}""",
+    'pest': """Language: {language}. Location: {state}. Task: Pest/Disease Diagnosis.
+        Crop: {crop_name}. Symptoms: {symptoms}. Duration: {duration}.
+        JSON exactly: {{"diagnosis_result": "string", "treatment_steps": ["step1", "step2"], "organic_option": "string", "prevention_tip": "string", "safety_warning": "string"}}""",
+    'weather': """Language: {language}. Location: {state}. Task: Weather Crisis Management.
+        Weather: {current_weather} at {temp}C. Risk: {forecast}. Crop: {crop}.
+        JSON exactly: {{"risk_level": "LOW/MEDIUM/HIGH", "yield_impact_estimate": "string", "immediate_actions": ["24h step1", "24h step2"], "short_term_actions": ["7day step1", "7day step2"]}}""",
+    'soil': """Language: {language}. Location: {state}. Task: Soil Analysis.
+        Data: pH: {ph}, OM: {om}%, N: {n}, P: {p}, K: {k}. Target Crop: {target_crop}.
+        Already computed locally (use as given): Classification: {classification}. Crop compatibility (0-100): {crop_compatibility_score}.
+        JSON exactly: {{"nutrient_balance_summary": "string", "amendment_recommendations": ["rec1", "rec2"]}}""",
+    'sustainable': """Language: {language}. Location: {state}. Task: Sustainable Farm Implementation.
+        Practice: {practice}. Farm Size: {farm_size}. Budget: {budget}.
+        JSON exactly: {{"vision_statement": "string", "implementation_steps": ["step1", "step2", "step3"], "expected_roi_time": "string", "environmental_impact": "string", "confidence_score": 0-100}}""",
+}
+
+def build_prompt(task: str, inputs: Dict[str, Any], state: str, language: str) -> str:
+    local = {k: 'unknown' if v is None else v for k, v in local_fields(task, [inputs])[0].items()}
+    prompt = PROMPTS[task].format(language=language, state=state, **inputs, **local)
+    return prompt + PHOTO_NOTE if inputs.get('image') else prompt
+
+# ── SOIL RULES ENGINE ───────────────────────────────────────────────────────
+# Deterministic, table-driven agronomy: pH class and crop compatibility are computed locally
+# (vectorised over any number of profiles, so batch jobs cost one numpy pass). The model is
+# only asked for the narrative; if it is unreachable the narrative comes from the same tables.
+NPK_LEVELS = ["Very Low", "Low", "Medium", "High", "Excessive"]
+PH_CLASSES, PH_EDGES = np.array(['Acidic', 'Neutral', 'Alkaline']), [6.5, 7.6]   # Neutral = 6.5–7.5
+OM_EDGES, OM_PENALTY = [1.0, 2.0, 5.0, 8.0], np.array([15, 8, 0, 0, 5])
+# crop: (pH min, pH max, N, P, K target as an index into NPK_LEVELS)
+CROP_TABLE = {
+    'wheat': (6.0, 7.5, 3, 2, 2), 'rice': (5.5, 7.0, 3, 2, 2), 'maize': (5.8, 7.0, 3, 2, 2), 'potato': (4.8, 6.5, 3, 3, 3),
+    'tomato': (6.0, 6.8, 2, 3, 3), 'sugarcane': (6.0, 7.5, 3, 2, 3), 'cotton': (5.8, 8.0, 2, 2, 2), 'soybean': (6.0, 7.0, 1, 2, 2),
+    'chickpea': (6.0, 8.0, 1, 2, 2), 'mustard': (6.0, 7.5, 2, 2, 2), 'onion': (6.0, 7.0, 2, 2, 3), 'groundnut': (5.5, 7.0, 1, 2, 2),
+    'barley': (6.0, 8.0, 2, 2, 2), 'canola': (5.5, 8.0, 3, 2, 2), 'cocoa': (5.0, 7.5, 2, 2, 3), 'cassava': (4.5, 7.0, 1, 1, 3),
+    'yam': (5.5, 6.5, 2, 2, 3), 'banana': (5.5, 7.0, 3, 2, 3), 'millet': (5.5, 7.5, 2, 1, 1), 'lentil': (6.0, 8.0, 1, 2, 2),
+}
+CROP_ALIASES = {'corn': 'maize', 'paddy': 'rice', 'gram': 'chickpea', 'peanut': 'groundnut', 'rapeseed': 'canola', 'soya': 'soybean', 'bajra': 'millet'}
+DEFAULT_CROP = (6.0, 7.0, 2, 2, 2)   # general guidance for crops not in the table; never scored
+# Offline narrative per session language (the languages in GEO); anything else falls back to English.
+OFFLINE_TEXT = {
+    'English': {
+        'soil': "{cls} soil.", 'ph_out': "pH {ph} is outside the {lo}–{hi} range for {crop}", 'nutrient': "{name} is {given} (target for {crop}: {target})",
+        'om_low': "organic matter is low at {om}%", 'stop': ".", 'ok': "Nutrient levels suit {crop}.", 'any_crop': "most crops",
+        'maintain': "Maintain current practice; re-test soil next season.",
+        ('ph', -1): "Apply agricultural lime to raise pH into the {lo}–{hi} range.",
+        ('ph', 1): "Apply elemental sulphur or gypsum to bring pH down toward {lo}–{hi}.",
+        ('N', -1): "Add nitrogen in split doses (urea, or well-rotted manure for organic plots).",
+        ('P', -1): "Apply phosphorus at sowing (DAP, single super phosphate or bone meal).",
+        ('K', -1): "Apply potassium (muriate of potash or wood ash).",
+        ('N', 1): "Skip nitrogen this season; excess N causes lush growth and pest pressure.",
+        ('P', 1): "Skip phosphorus fertiliser; excess P locks up zinc and iron.",
+        ('K', 1): "Skip potash this season; excess K reduces magnesium uptake.",
+        ('om', -1): "Work in compost, farmyard manure or a green-manure crop to lift organic matter above 2%.",
+    },
+    'Hindi': {
+        'soil': "मिट्टी का वर्ग: {cls}।", 'ph_out': "pH {ph}, {crop} के लिए उपयुक्त {lo}–{hi} की सीमा से बाहर है", 'nutrient': "{name} का स्तर {given} है ({crop} के लिए लक्ष्य: {target})",
+        'om_low': "जैविक पदार्थ कम है ({om}%)", 'stop': "।", 'ok': "पोषक तत्वों का स्तर {crop} के लिए उपयुक्त है।", 'any_crop': "अधिकांश फसलों",
+        'maintain': "वर्तमान तरीका जारी रखें; अगले मौसम में मिट्टी की फिर से जाँच कराएँ।",
+        ('ph', -1): "pH को {lo}–{hi} की सीमा में लाने के लिए कृषि चूना डालें।",
+        ('ph', 1): "pH को {lo}–{hi} की ओर घटाने के लिए तात्विक गंधक या जिप्सम डालें।",
+        ('N', -1): "नाइट्रोजन किस्तों में डालें (यूरिया, या जैविक खेतों में अच्छी सड़ी गोबर की खाद)।",
+        ('P', -1): "बुवाई के समय फॉस्फोरस डालें (DAP, सिंगल सुपर फॉस्फेट या हड्डी का चूरा)।",
+        ('K', -1): "पोटैशियम डालें (म्यूरेट ऑफ पोटाश या लकड़ी की राख)।",
+        ('N', 1): "इस मौसम नाइट्रोजन न डालें; अधिक नाइट्रोजन से घनी बढ़वार और कीटों का दबाव बढ़ता है।",
+        ('P', 1): "फॉस्फोरस उर्वरक न डालें; अधिक फॉस्फोरस जिंक और आयरन की उपलब्धता रोकता है।",
+        ('K', 1): "इस मौसम पोटाश न डालें; अधिक पोटैशियम मैग्नीशियम का अवशोषण घटाता है।",
+        ('om', -1): "जैविक पदार्थ 2% से ऊपर लाने के लिए कम्पोस्ट, गोबर की खाद या हरी खाद की फसल मिलाएँ।",
+    },
+    'French': {
+        'soil': "Classe de sol : {cls}.", 'ph_out': "Le pH {ph} est hors de la plage {lo}–{hi} pour {crop}", 'nutrient': "{name} est {given} (cible pour {crop} : {target})",
+        'om_low': "la matière organique est faible ({om} %)", 'stop': ".", 'ok': "Les niveaux de nutriments conviennent à {crop}.", 'any_crop': "la plupart des cultures",
+        'maintain': "Conservez les pratiques actuelles ; refaites une analyse de sol la saison prochaine.",
+        ('ph', -1): "Apportez de la chaux agricole pour remonter le pH dans la plage {lo}–{hi}.",
+        ('ph', 1): "Apportez du soufre élémentaire ou du gypse pour abaisser le pH vers {lo}–{hi}.",
+        ('N', -1): "Apportez l'azote en plusieurs fois (urée, ou fumier bien décomposé en bio).",
+        ('P', -1): "Apportez du phosphore au semis (DAP, superphosphate simple ou farine d'os).",
+        ('K', -1): "Apportez du potassium (chlorure de potassium ou cendre de bois).",
+        ('N', 1): "Pas d'azote cette saison : un excès favorise une croissance trop vigoureuse et les ravageurs.",
+        ('P', 1): "Pas d'engrais phosphaté : un excès de P bloque le zinc et le fer.",
+        ('K', 1): "Pas de potasse cette saison : un excès de K réduit l'absorption du magnésium.",
+        ('om', -1): "Incorporez du compost, du fumier ou un engrais vert pour dépasser 2 % de matière organique.",
+    },
+}
+
+def match_crop(name: str) -> Optional[str]:
+    words = re.findall(r'[a-z]+', (name or '').lower())
+    for w in reversed(words):
+        for cand in (w, w[:-2] if w.endswith('es') else w, w[:-1] if w.endswith('s') else w):
+            cand = CROP_ALIASES.get(cand, cand)
+            if cand in CROP_TABLE: return cand
+    return None
+
+def soil_rules(rows: List[Dict[str, Any]]) -> Dict[str, np.ndarray]:
+    ph = np.round(np.array([float(r['ph']) for r in rows]), 1)
+    om = np.array([float(r['om']) for r in rows])
+    level = {l.lower(): i for i, l in enumerate(NPK_LEVELS)}
+    npk = np.array([[level.get(str(r[x]).strip().lower(), 2) for x in ('n', 'p', 'k')] for r in rows]).reshape(-1, 3)
+    crops = [match_crop(r['target_crop']) for r in rows]
+    table = np.array([CROP_TABLE.get(c, DEFAULT_CROP) for c in crops], dtype=float).reshape(-1, 5)
+    ph_gap = np.where(ph < table[:, 0], ph - table[:, 0], np.where(ph > table[:, 1], ph - table[:, 1], 0.0))
+    npk_gap = npk - table[:, 2:5]
+    score = 100 - np.minimum(50, 20 * np.abs(ph_gap)) - np.minimum(36, 8 * np.abs(npk_gap).sum(axis=1)) - OM_PENALTY[np.digitize(om, OM_EDGES)]
+    return {'classification': PH_CLASSES[np.digitize(ph, PH_EDGES)], 'crop_compatibility_score': np.clip(np.rint(score), 0, 100).astype(int),
+            'known_crop': np.array([c is not None for c in crops], dtype=bool),
+            'ph_range': table[:, :2], 'ph_gap': ph_gap, 'npk_gap': npk_gap, 'npk_target': table[:, 2:5].astype(int), 'om': om}
+
+def soil_local_fields(rows: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    r = soil_rules(rows)
+    # No score for crops outside CROP_TABLE: general targets are fine for advice, not for a number.
+    return [{'classification': str(c), 'crop_compatibility_score': int(s) if known else None}
+            for c, s, known in zip(r['classification'], r['crop_compatibility_score'], r['known_crop'])]
+
+def soil_offline(inputs: Dict[str, Any], language: str = 'English') -> Dict[str, Any]:
+    r, text = {k: v[0] for k, v in soil_rules([inputs]).items()}, OFFLINE_TEXT.get(language, OFFLINE_TEXT['English'])
+    crop = inputs['target_crop'] if r['known_crop'] else text['any_crop']
+    lo, hi = r['ph_range']
+    notes, recs = [], []
+    if r['ph_gap']:
+        notes.append(text['ph_out'].format(ph=inputs['ph'], lo=lo, hi=hi, crop=crop))
+        recs.append(text[('ph', int(np.sign(r['ph_gap'])))].format(lo=lo, hi=hi))
+    for name, gap, target, given in zip('NPK', r['npk_gap'], r['npk_target'], (inputs['n'], inputs['p'], inputs['k'])):
+        if gap:
+            notes.append(text['nutrient'].format(name=name, given=given, crop=crop, target=NPK_LEVELS[target]))
+            recs.append(text[(name, int(np.sign(gap)))])
+    if r['om'] < 2.0:
+        notes.append(text['om_low'].format(om=inputs['om']))
+        recs.append(text[('om', -1)])
+    summary = text['soil'].format(cls=r['classification']) + " " + ("; ".join(notes) + text['stop'] if notes else text['ok'].format(crop=crop))
+    return {'nutrient_balance_summary': summary, 'amendment_recommendations': recs or [text['maintain']]}
+
+LOCAL_RULES = {'soil': soil_local_fields}
+OFFLINE_RULES = {'soil': soil_offline}
+
+def local_fields(task: str, rows: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    return LOCAL_RULES[task](rows) if task in LOCAL_RULES else [{} for _ in rows]
+
+# ── RESPONSE SCHEMAS ────────────────────────────────────────────────────────
+# Sent to Gemini as response_schema (JSON mode) and used locally to validate and coerce replies.
+STR, INT = {'type': 'string'}, {'type': 'integer'}
+RISK = {'type': 'string', 'enum': ['LOW', 'MEDIUM', 'HIGH']}
+
+def _obj(props: Dict[str, Dict]) -> Dict:
+    return {'type': 'object', 'properties': props, 'required': list(props)}
+
+def _list(item: Dict) -> Dict:
+    return {'type': 'array', 'items': item}
+
+SCHEMAS = {
+    'crop_rec': _obj({'location_analysis': STR, 'suggestions': _list(_obj({'crop_name': STR, 'reason': STR, 'risk_level': RISK, 'market_potential': STR})), 'confidence_score': INT}),
+    'pest': _obj({'diagnosis_result': STR, 'treatment_steps': _list(STR), 'organic_option': STR, 'prevention_tip': STR, 'safety_warning': STR}),
+    'weather': _obj({'risk_level': RISK, 'yield_impact_estimate': STR, 'immediate_actions': _list(STR), 'short_term_actions': _list(STR)}),
+    'soil': _obj({'nutrient_balance_summary': STR, 'amendment_recommendations': _list(STR)}),  # classification/score: soil rules engine
+    'sustainable': _obj({'vision_statement': STR, 'implementation_steps': _list(STR), 'expected_roi_time': STR, 'environmental_impact': STR, 'confidence_score': INT}),
+}
+
+def subschema(task: str, fields: List[str]) -> Dict:
+    return _obj({f: SCHEMAS[task]['properties'][f] for f in fields})
+
+def coerce_value(value: Any, spec: Dict) -> Any:
+    if value is None: return None
+    kind = spec['type']
+    if kind == 'string':
+        value = str(value).strip()
+        if 'enum' in spec:
+            value = next((e for e in spec['enum'] if e.lower() == value.lower()), None)
+        return value or None
+    if kind == 'integer':
+        m = re.search(r'-?\d+(\.\d+)?', str(value))
+        return int(float(m.group())) if m and not isinstance(value, bool) else None
+    if kind == 'array':
+        items = [coerce_value(v, spec['items']) for v in (value if isinstance(value, list) else [value])]
+        return [v for v in items if v is not None] or None
+    if kind == 'object' and isinstance(value, dict):
+        clean, missing = validate_response(value, spec)
+        return None if missing else clean
+    return None
+
+def validate_response(data: Dict, schema: Dict):
+    # Returns (clean, missing): the fields that validated, coerced to their schema types,
+    # and the required fields that are absent or unusable.
+    clean, missing = {}, []
+    for name, spec in schema['properties'].items():
+        value = coerce_value(data.get(name), spec)
+        if value is not None: clean[name] = value
+        elif name in schema.get('required', []): missing.append(name)
+    return clean, missing
+
+class ParseMetrics:
+    OUTCOMES = ('strict', 'repaired', 'reasked', 'failed')
+
+    def __init__(self):
+        self.counts = {o: 0 for o in self.OUTCOMES}
+        self.schema_supported = True
+        self._lock = threading.Lock()
+
+    def record(self, outcome: str):
+        with self._lock: self.counts[outcome] += 1
+
+    def reject_schema(self, err: Exception) -> bool:
+        # Only an InvalidArgument about JSON mode itself turns it off process-wide; others
+        # (a bad image part, an oversized prompt) belong to one request and are re-raised.
+        if not any(hint in str(err).lower() for hint in ('schema', 'mime_type', 'mime type')): return False
+        self.schema_supported = False
+        return True
+
+    def stats(self) -> Dict[str, Any]:
+        total = sum(self.counts.values())
+        ok = total - self.counts['failed']
+        return {**self.counts, 'total': total, 'success_rate': round(ok / total, 3) if total else 0.0,
+                'repair_rate': round((self.counts['repaired'] + self.counts['reasked']) / total, 3) if total else 0.0,
+                'schema_supported': self.schema_supported}
+
+@st.cache_resource
+def get_parse_metrics() -> ParseMetrics:
+    return ParseMetrics()
+
+# ── RESPONSE CACHE ──────────────────────────────────────────────────────────
+# Shared by every session in the process: identical advisories (same task, inputs,
+# region, language and model settings) are answered without a Gemini round trip.
+CACHE_MAX_ENTRIES = 5000
+CACHE_TTL = {'crop_rec': 6 * 3600, 'pest': 24 * 3600, 'weather': 1800, 'soil': 7 * 86400, 'sustainable': 7 * 86400}
+
+class ResponseCache:
+    def __init__(self, max_entries: int, ttls: Dict[str, int], default_ttl: int = 3600):
+        self.max_entries, self.ttls, self.default_ttl = max_entries, ttls, default_ttl
+        self._data: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = self.misses = self.evictions = 0
+
+    def get(self, key: str) -> Optional[Dict]:
+        with self._lock:
+            item = self._data.get(key)
+            if item and item[0] > time.time():
+                self._data.move_to_end(key); self.hits += 1
+                return copy.deepcopy(item[1])
+            if item: del self._data[key]
+            self.misses += 1
+        return None
+
+    def put(self, task: str, key: str, value: Dict):
+        with self._lock:
+            self._data[key] = (time.time() + self.ttls.get(task, self.default_ttl), copy.deepcopy(value))
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False); self.evictions += 1
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {'entries': len(self._data), 'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions, 'hit_rate': round(self.hits / total, 3) if total else 0.0}
+
+@st.cache_resource
+def get_response_cache() -> ResponseCache:
+    return ResponseCache(CACHE_MAX_ENTRIES, CACHE_TTL)
+
+def normalize_inputs(inputs: Dict[str, Any]) -> Dict[str, Any]:
+    norm = {}
+    for k, v in sorted(inputs.items()):
+        if isinstance(v, str): v = ' '.join(v.split()).lower()
+        elif isinstance(v, float): v = round(v, 1)
+        norm[k] = v
+    return norm
+
+def cache_key(task: str, inputs: Dict[str, Any], state: str, language: str) -> str:
+    raw = json.dumps([task, normalize_inputs(inputs), state, language, MODEL_NAME, MODEL_TEMPERATURE], ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+# ── METRICS ─────────────────────────────────────────────────────────────────
+# Process-wide telemetry: counters and latency summaries for model calls, cache lookups,
+# parsing and script reruns. Exposed as Prometheus text (AGSAATHI_METRICS_PORT), appended to a
+# JSONL sink (AGSAATHI_METRICS_JSONL) and shown on the hidden admin page.
+METRICS_WINDOW = 2048
+ADMIN_TOKEN = os.environ.get("AGSAATHI_ADMIN_TOKEN") or (None if USE_FAKE_MODEL else st.secrets.get("ADMIN_TOKEN", None))
+
+class Metrics:
+    def __init__(self, jsonl_path: Optional[str] = None):
+        self.counters: Dict[tuple, float] = defaultdict(float)
+        self.summaries: Dict[tuple, Dict[str, Any]] = {}
+        self.jsonl_path = jsonl_path
+        self._lock = threading.Lock()
+        # Samples are appended by a writer thread so a slow disk never stalls callers holding the lock.
+        self._samples: "queue.Queue[str]" = queue.Queue()
+        if jsonl_path:
+            threading.Thread(target=self._write_samples, name="metrics-jsonl", daemon=True).start()
+
+    def _write_samples(self):
+        while True:
+            lines = [self._samples.get()]
+            while True:
+                try: lines.append(self._samples.get_nowait())
+                except queue.Empty: break
+            try:
+                with open(self.jsonl_path, 'a', encoding='utf-8') as f: f.writelines(lines)
+            except OSError:
+                pass
+
+    @staticmethod
+    def _key(name: str, labels: Dict[str, Any]) -> tuple:
+        return (name, tuple(sorted((k, str(v)) for k, v in labels.items())))
+
+    def inc(self, name: str, value: float = 1, **labels):
+        with self._lock: self.counters[self._key(name, labels)] += value
+
+    def observe(self, name: str, seconds: float, **labels):
+        self.observe_value(name, seconds, unit='seconds', **labels)
+
+    def observe_value(self, name: str, value: float, unit: str, **labels):
+        with self._lock:
+            s = self.summaries.setdefault(self._key(name, labels), {'unit': unit, 'count': 0, 'sum': 0.0, 'window': deque(maxlen=METRICS_WINDOW)})
+            s['count'] += 1; s['sum'] += value; s['window'].append(value)
+        if self.jsonl_path:
+            self._samples.put(json.dumps({'ts': time.time(), 'metric': name, 'value': round(value, 6), 'unit': unit, **labels}) + "\n")
+
+    def observe_model(self, task: str, seconds: float, resp: Any, stage: str = 'total'):
+        self.observe('agsaathi_model_seconds', seconds, task=task, stage=stage)
+        usage = getattr(resp, 'usage_metadata', None)
+        if usage:
+            self.inc('agsaathi_model_tokens_total', getattr(usage, 'prompt_token_count', 0) or 0, task=task, kind='prompt')
+            self.inc('agsaathi_model_tokens_total', getattr(usage, 'candidates_token_count', 0) or 0, task=task, kind='response')
+
+    def timer(self, name: str, **labels):
+        return _MetricsTimer(self, name, labels)
+
+    def _summaries(self) -> List[Tuple[str, tuple, str, int, float, Dict[str, float]]]:
+        # Raw (unrounded) snapshot: name, labels, unit, count, sum and the window's p50/p95/p99.
+        with self._lock:
+            items = [(k, s['unit'], s['count'], s['sum'], sorted(s['window'])) for k, s in self.summaries.items()]
+        return [(name, labels, unit, count, total, {q: w[int(float(f'0.{q}') * (len(w) - 1))] for q in ('50', '95', '99')})
+                for (name, labels), unit, count, total, w in items]
+
+    def summary_rows(self) -> List[Dict[str, Any]]:
+        return [{'metric': name, **dict(labels), 'unit': unit, 'count': count, 'mean': round(total / count, 4),
+                 **{f'p{q}': round(v, 4) for q, v in quantiles.items()}}
+                for name, labels, unit, count, total, quantiles in self._summaries()]
+
+    def gauges(self) -> Dict[str, Any]:
+        return {'cache': get_response_cache().stats(), 'pack': get_advisory_pack().stats(), 'parse': get_parse_metrics().stats(),
+                'model_client': get_model().stats(), 'images': get_image_cache().stats()}
+
+    def prometheus(self) -> str:
+        def fmt(labels): return "{" + ",".join(f'{k}="{v}"' for k, v in labels) + "}" if labels else ""
+        lines = []
+        with self._lock:
+            for (name, labels), value in sorted(self.counters.items()):
+                lines.append(f"{name}{fmt(labels)} {value:g}")
+        typed = set()
+        # Exported unrounded: sub-millisecond timings would otherwise lose most of their value.
+        for name, labels, unit, count, total, quantiles in sorted(self._summaries(), key=lambda s: s[:2]):
+            if name not in typed:
+                typed.add(name)
+                lines += [f"# HELP {name} Summary in {unit}.", f"# TYPE {name} summary"]
+            for q, v in quantiles.items():
+                lines.append(f"{name}{fmt(labels + (('quantile', f'0.{q}'),))} {v!r}")
+            lines.append(f"{name}_count{fmt(labels)} {count}")
+            lines.append(f"{name}_sum{fmt(labels)} {total!r}")
+        for group, values in self.gauges().items():
+            for k, v in values.items():
+                if isinstance(v, (int, float)): lines.append(f"agsaathi_{group}_{k} {float(v):g}")
+        return "\n".join(lines) + "\n"
+
+class _MetricsTimer:
+    def __init__(self, metrics: Metrics, name: str, labels: Dict[str, Any]):
+        self.metrics, self.name, self.labels = metrics, name, labels
+
+    def __enter__(self):
+        self.started = time.perf_counter(); return self
+
+    def __exit__(self, *exc):
+        self.metrics.observe(self.name, time.perf_counter() - self.started, **self.labels)
+
+def serve_metrics(metrics: Metrics, port: int):
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            body = metrics.prometheus().encode('utf-8')
+            self.send_response(200); self.send_header('Content-Type', 'text/plain; version=0.0.4'); self.end_headers()
+            self.wfile.write(body)
+        def log_message(self, *args): pass
+    server = ThreadingHTTPServer(('0.0.0.0', port), Handler)
+    threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+
+@st.cache_resource
+def get_metrics() -> Metrics:
+    metrics = Metrics(os.environ.get("AGSAATHI_METRICS_JSONL"))
+    if os.environ.get("AGSAATHI_METRICS_PORT"): serve_metrics(metrics, int(os.environ["AGSAATHI_METRICS_PORT"]))
+    return metrics
+
+def instrumented(fn: Callable) -> Callable:
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        with get_metrics().timer('agsaathi_render_seconds', fn=fn.__name__):
+            return fn(*args, **kwargs)
+    return wrapper
+
+# ── ADVISORY PACKS ──────────────────────────────────────────────────────────
+# Advisories for common region × language × option combinations, generated offline by
+# precompute.py into one compact file: magic, index length, JSON index {pack key: [offset,
+# length, created_at, task]}, then zlib-compressed results. The file is memory-mapped, so
+# lookups only touch the bytes they need; a refreshed pack is picked up without a restart.
+PACK_PATH = os.environ.get("AGSAATHI_PACK_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "packs", "advisory_pack.bin"))
+PACK_MAGIC = b"AGSPACK1"
+PACK_MAX_AGE = {'weather': 2 * 86400, 'sustainable': 30 * 86400}
+PACK_RELOAD_S = 60
+# Packs are keyed on the enumerable form fields and generated with every other field at its
+# form default. A query that changes any of those (weather notes, temperature, farm size,
+# budget) asks about a different situation, so it goes to the model instead.
+PACK_FIELDS = {'weather': ('forecast', 'crop'), 'sustainable': ('practice',)}
+PACK_DEFAULTS = {'weather': {'current_weather': '', 'temp': WEATHER_DEFAULT_TEMP}, 'sustainable': {'farm_size': '', 'budget': ''}}
+
+class AdvisoryPack:
+    def __init__(self, path: str):
+        # One immutable (index, mmap, data offset, mtime) snapshot, swapped whole on reload so a
+        # reader never pairs a new index with the old file's bytes.
+        self.path, self._snap, self._checked = path, ({}, None, 0, 0.0), 0.0
+        self._lock = threading.Lock()
+        self._load()
+
+    @property
+    def index(self) -> Dict[str, list]:
+        return self._snap[0]
+
+    @property
+    def mtime(self) -> float:
+        return self._snap[3]
+
+    def _load(self):
+        try:
+            with open(self.path, 'rb') as f:
+                mtime, mm = os.fstat(f.fileno()).st_mtime, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (FileNotFoundError, ValueError):
+            return
+        if mm[:8] != PACK_MAGIC: return
+        size = struct.unpack('<Q', mm[8:16])[0]
+        self._snap = (json.loads(mm[16:16 + size]), mm, 16 + size, mtime)
+
+    def _maybe_reload(self):
+        now = time.monotonic()
+        if now - self._checked < PACK_RELOAD_S: return
+        with self._lock:
+            self._checked = now
+            try:
+                changed = os.stat(self.path).st_mtime != self.mtime
+            except FileNotFoundError:
+                changed = False
+            if changed: self._load()
+
+    def get(self, key: str, max_age_s: Optional[float] = None) -> Optional[Dict]:
+        self._maybe_reload()
+        index, mm, base, _ = self._snap
+        entry = index.get(key)
+        if not entry or (max_age_s is not None and time.time() - entry[2] > max_age_s): return None
+        return json.loads(zlib.decompress(mm[base + entry[0]:base + entry[0] + entry[1]]))
+
+    def entries(self) -> Iterator[Tuple[str, str, float, Dict]]:
+        for key, (_, _, created, task) in self.index.items():
+            yield key, task, created, self.get(key)
+
+    def stats(self) -> Dict[str, Any]:
+        return {'entries': len(self.index), 'built_at': self.mtime}
+
+def write_pack(path: str, entries: Iterable[Tuple[str, str, float, Dict]]):
+    index, blob = {}, bytearray()
+    for key, task, created, result in entries:
+        data = zlib.compress(json.dumps(result, ensure_ascii=False, separators=(',', ':')).encode('utf-8'), 9)
+        index[key] = [len(blob), len(data), round(created, 1), task]
+        blob += data
+    head = json.dumps(index, separators=(',', ':')).encode('utf-8')
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    with open(path + '.tmp', 'wb') as f:
+        f.write(PACK_MAGIC + struct.pack('<Q', len(head)) + head + blob)
+    os.replace(path + '.tmp', path)  # atomic: running apps switch to the new pack on their next check
+
+@st.cache_resource
+def get_advisory_pack() -> AdvisoryPack:
+    return AdvisoryPack(PACK_PATH)
+
+def pack_key(task: str, inputs: Dict[str, Any], state: str, language: str) -> Optional[str]:
+    if task not in PACK_FIELDS: return None
+    if normalize_inputs({f: inputs.get(f, v) for f, v in PACK_DEFAULTS[task].items()}) != normalize_inputs(PACK_DEFAULTS[task]): return None
+    return cache_key(task, {f: inputs.get(f) for f in PACK_FIELDS[task]}, state, language)
+
+def cached_advisory(task: str, key: str, inputs: Dict[str, Any], state: str, language: str) -> Optional[Dict]:
+    # In-process response cache first, then the precomputed regional pack.
+    res, source, pkey = get_response_cache().get(key), 'hit', pack_key(task, inputs, state, language)
+    if res is None:
+        res, source = (get_advisory_pack().get(pkey, PACK_MAX_AGE.get(task)) if pkey else None), 'pack'
+        if res is None: source = 'miss'
+        else: get_response_cache().put(task, key, res)
+    get_metrics().inc('agsaathi_cache_requests_total', task=task, result=source)
+    return res
+
+# ── PEST PHOTO INGEST ───────────────────────────────────────────────────────
+# Phone photos never go to the model as uploaded: each one is decoded in a thread pool, rotated
+# by its EXIF orientation and stripped of EXIF, downscaled and re-encoded as JPEG under a byte
+# budget. A 64-bit difference hash (dHash) spots near-duplicate shots: for the same crop and
+# region, a photo within IMAGE_DEDUPE_DISTANCE bits of an earlier one takes that photo's id, so
+# its diagnosis comes from the response cache or the farmer's history, not a new model call.
+IMAGE_MAX_SIDE = 768
+IMAGE_MAX_BYTES = 150_000
+IMAGE_QUALITIES = (82, 72, 62, 50)
+IMAGE_MAX_FILES = 3
+IMAGE_WORKERS = 4
+IMAGE_DEDUPE_DISTANCE = 6
+IMAGE_DEDUPE_PER_SCOPE = 256
+IMAGE_STORE_MAX_BYTES = 64 * 1024 * 1024
+PHOTO_NOTE = "\n        Photos of the affected crop are attached; base the diagnosis on them together with the symptoms."
+
+def dhash(img: Image.Image) -> int:
+    px = np.asarray(img.convert('L').resize((9, 8), Image.Resampling.LANCZOS), dtype=np.int16)
+    return int.from_bytes(np.packbits(px[:, 1:] > px[:, :-1]).tobytes(), 'big')
+
+def prepare_image(data: bytes) -> Dict[str, Any]:
+    started = time.perf_counter()
+    img = Image.open(io.BytesIO(data))
+    img.draft('RGB', (IMAGE_MAX_SIDE * 2, IMAGE_MAX_SIDE * 2))  # JPEGs decode straight at a reduced scale
+    img = ImageOps.exif_transpose(img).convert('RGB')
+    img.thumbnail((IMAGE_MAX_SIDE, IMAGE_MAX_SIDE), Image.Resampling.LANCZOS)
+    for quality in IMAGE_QUALITIES:  # saved without exif=, so no metadata (GPS, device) survives
+        out = io.BytesIO()
+        img.save(out, 'JPEG', quality=quality, optimize=True, progressive=True)
+        if out.tell() <= IMAGE_MAX_BYTES: break
+    return {'jpeg': out.getvalue(), 'hash': dhash(img), 'upload_bytes': len(data), 'encode_s': time.perf_counter() - started}
+
+class ImageCache:
+    def __init__(self, max_distance: int, per_scope: int, max_bytes: int):
+        self.max_distance, self.max_bytes, self.size = max_distance, max_bytes, 0
+        self.scopes: Dict[tuple, deque] = defaultdict(lambda: deque(maxlen=per_scope))
+        self.blobs: "OrderedDict[str, bytes]" = OrderedDict()
+        self.hits = self.misses = 0
+        self._lock = threading.Lock()
+
+    def canonical(self, scope: tuple, h: int) -> Tuple[str, bool]:
+        # Returns the id of the closest earlier photo in this scope if it is a near-duplicate.
+        with self._lock:
+            seen = self.scopes[scope]
+            match = min(seen, key=lambda s: (s ^ h).bit_count(), default=None)
+            if match is not None and (match ^ h).bit_count() <= self.max_distance:
+                self.hits += 1
+                return f"{match:016x}", True
+            seen.append(h); self.misses += 1
+            return f"{h:016x}", False
+
+    def put(self, image_id: str, jpeg: bytes):
+        with self._lock:
+            if image_id in self.blobs:
+                self.blobs.move_to_end(image_id); return
+            self.blobs[image_id] = jpeg; self.size += len(jpeg)
+            while self.size > self.max_bytes:
+                self.size -= len(self.blobs.popitem(last=False)[1])
+
+    def get(self, image_id: str) -> Optional[bytes]:
+        with self._lock:
+            if image_id in self.blobs: self.blobs.move_to_end(image_id)
+            return self.blobs.get(image_id)
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {'dedupe_hits': self.hits, 'dedupe_misses': self.misses, 'dedupe_hit_rate': self.hits / total if total else 0.0,
+                'stored': len(self.blobs), 'stored_bytes': self.size}
+
+@st.cache_resource
+def get_image_cache() -> ImageCache:
+    return ImageCache(IMAGE_DEDUPE_DISTANCE, IMAGE_DEDUPE_PER_SCOPE, IMAGE_STORE_MAX_BYTES)
+
+@st.cache_resource
+def get_image_pool() -> concurrent.futures.ThreadPoolExecutor:
+    # Pillow releases the GIL while decoding and resampling, so photos are processed in parallel.
+    return concurrent.futures.ThreadPoolExecutor(IMAGE_WORKERS, thread_name_prefix="image-ingest")
+
+def ingest_photos(files: List[Any], scope: tuple) -> Tuple[List[str], List[str]]:
+    # Returns the sorted image ids for the prompt inputs and the names of unreadable files.
+    metrics, cache = get_metrics(), get_image_cache()
+    jobs = [(f.name, get_image_pool().submit(prepare_image, f.getvalue())) for f in files[:IMAGE_MAX_FILES]]
+    ids, failed = set(), []
+    for name, fut in jobs:
+        try:
+            img = fut.result()
+        except (OSError, ValueError, Image.DecompressionBombError):
+            failed.append(name); continue
+        metrics.observe_value('agsaathi_image_upload_bytes', img['upload_bytes'], unit='bytes')
+        metrics.observe_value('agsaathi_image_encoded_bytes', len(img['jpeg']), unit='bytes')
+        metrics.observe('agsaathi_image_encode_seconds', img['encode_s'])
+        image_id, hit = cache.canonical(scope, img['hash'])
+        metrics.inc('agsaathi_image_dedupe_total', result='hit' if hit else 'miss')
+        cache.put(image_id, img['jpeg'])
+        ids.add(image_id)
+    return sorted(ids), failed
+
+def image_parts(inputs: Dict[str, Any]) -> List[Dict[str, Any]]:
+    cache = get_image_cache()
+    blobs = [cache.get(i) for i in (inputs.get('image') or '').split(',') if i]
+    return [{'mime_type': 'image/jpeg', 'data': b} for b in blobs if b]
 
 # ── AI HELPER ───────────────────────────────────────────────────────────────
-def call_ai(prompt: str) -> Optional[Dict]:
+STREAM_RESPONSES = True
+
+def parse_json(resp: str) -> Optional[Dict]:
+    text = re.sub(r'```json|```', '', resp).strip()
+    start, end = text.find('{'), text.rfind('}') + 1
+    return json.loads(text[start:end]) if start != -1 else None
+
+def parse_partial_json(resp: str) -> Optional[Dict]:
+    # Tolerant parse of a JSON object that is still being generated: cut back to the last
+    # completed top-level field or list item and close whatever brackets are still open.
+    # Cuts inside list items (depth > 2) are skipped so e.g. a crop card only appears whole.
+    text = re.sub(r'```json|```', '', resp)
+    start = text.find('{')
+    if start == -1: return None
+    stack, in_str, esc, cuts = [], False, False, []
+    for i in range(start, len(text)):
+        ch = text[i]
+        if in_str:
+            if esc: esc = False
+            elif ch == '\\': esc = True
+            elif ch == '"': in_str = False
+        elif ch == '"': in_str = True
+        elif ch in '{[': stack.append('}' if ch == '{' else ']')
+        elif ch in '}]':
+            if stack: stack.pop()
+            if not stack:
+                cuts.append((i + 1, ''))
+                break
+            if len(stack) <= 2: cuts.append((i + 1, ''.join(reversed(stack))))
+        elif ch == ',' and len(stack) <= 2:
+            cuts.append((i, ''.join(reversed(stack))))
+    for pos, closers in reversed(cuts):
+        try: return json.loads(text[start:pos] + closers)
+        except ValueError: continue
+    return {}
+
+def model_generate(prompt: str, task: str, fields: Optional[List[str]] = None, stream: bool = False, images: Optional[List[Dict]] = None):
+    started = time.perf_counter()
+    resp = _structured_generate([prompt, *images] if images else prompt, task, fields, stream)
+    if not stream:  # streams are timed by the caller as chunks arrive
+        get_metrics().observe_model(task, time.perf_counter() - started, resp, stage='reask' if fields else 'total')
+    return resp
+
+def structured_config(schema: Dict) -> Optional[genai.GenerationConfig]:
+    if not get_parse_metrics().schema_supported: return None
+    return genai.GenerationConfig(temperature=MODEL_TEMPERATURE, response_mime_type="application/json", response_schema=schema)
+
+def _structured_generate(contents: Any, task: str, fields: Optional[List[str]], stream: bool):
+    # JSON mode with the task schema when the model accepts it, plain prompting otherwise.
+    metrics = get_parse_metrics()
+    if metrics.schema_supported:
+        config = structured_config(subschema(task, fields) if fields else SCHEMAS[task])
+        try:
+            return get_model().generate_content(contents, generation_config=config, stream=stream)
+        except google_exceptions.InvalidArgument as e:
+            if not metrics.reject_schema(e): raise
+    return get_model().generate_content(contents, stream=stream)
+
+def finalize_response(task: str, prompt: str, text: str, images: Optional[List[Dict]] = None) -> Tuple[Optional[Dict], bool]:
+    # Strict parse, then local repair (truncation, trailing commas), then a re-ask for only
+    # the fields that are still missing. Returns (result, complete).
+    metrics, outcome = get_parse_metrics(), 'strict'
+    try:
+        data = parse_json(text)
+    except ValueError:
+        data = None
+    if not isinstance(data, dict):
+        data, outcome = parse_partial_json(text) or {}, 'repaired'
+    res, missing = validate_response(data, SCHEMAS[task])
+    if missing:
+        outcome = 'reasked'
+        reask = prompt + f"\n        Your previous answer was incomplete. Return ONLY a JSON object with these fields: {', '.join(missing)}."
+        try:
+            extra, missing = validate_response(parse_partial_json(model_generate(reask, task, missing, images=images).text) or {}, subschema(task, missing))
+            res.update(extra)
+        except Exception:
+            pass
+    metrics.record('failed' if missing else outcome)
+    get_metrics().inc('agsaathi_parse_total', task=task, outcome='failed' if missing else outcome)
+    return (res or None), not missing
+
+def generate_advisory(task: str, inputs: Dict[str, Any], state: str, language: str) -> Tuple[Optional[Dict], bool]:
+    # Returns (result, complete); only complete results are cached or saved to history.
+    cache, key = get_response_cache(), cache_key(task, inputs, state, language)
+    res = cached_advisory(task, key, inputs, state, language)
+    if res is not None: return res, True
+    prompt, local, images = build_prompt(task, inputs, state, language), local_fields(task, [inputs])[0], image_parts(inputs)
+    res, complete = finalize_response(task, prompt, model_generate(prompt, task, images=images).text, images)
+    res = {**local, **(res or {})} or None
+    if complete: cache.put(task, key, res)
+    return res, complete
+
+def stream_advisory(task: str, inputs: Dict[str, Any], state: str, language: str) -> Iterator[Tuple[Dict, bool]]:
+    # Yields (result so far, complete); everything before the final yield is partial.
+    cache, key, metrics = get_response_cache(), cache_key(task, inputs, state, language), get_metrics()
+    res = cached_advisory(task, key, inputs, state, language)
+    if res is not None:
+        yield res, True; return
+    prompt, buf, last, chunk = build_prompt(task, inputs, state, language), '', None, None
+    local, images = local_fields(task, [inputs])[0], image_parts(inputs)
+    if local:  # rules-engine fields render before the model is even called
+        last = local; yield local, False
+    started = time.perf_counter()
+    for chunk in model_generate(prompt, task, stream=True, images=images):
+        if not buf: metrics.observe('agsaathi_model_seconds', time.perf_counter() - started, task=task, stage='first_chunk')
+        buf += chunk.text
+        partial = parse_partial_json(buf)
+        if partial and {**local, **partial} != last:
+            last = {**local, **partial}; yield last, False
+    metrics.observe_model(task, time.perf_counter() - started, chunk)
+    res, complete = finalize_response(task, prompt, buf, images)
+    res = {**local, **(res or {})} or None
+    if complete: cache.put(task, key, res)
+    if res: yield res, complete
+
+def call_ai(task: str, inputs: Dict[str, Any], show: Callable[[Dict, Dict], None]) -> Optional[Dict]:
+    # Renders into a single placeholder; in streaming mode each completed field or list
+    # item redraws the panel so farmers see the first advice before generation finishes.
+    box, res, shown, complete = st.empty(), None, None, False
+    state, language = st.session_state.state, st.session_state.language
+    store, farmer, key = get_history_store(), get_farmer_id(), cache_key(task, inputs, state, language)
+    past = store.find_run(farmer, task, key, CACHE_TTL.get(task, 3600))
+    if past:  # this farmer already asked exactly this: re-display, no model call
+        with box.container(): show(past['result'], inputs)
+        st.caption(f"🕘 From your history ({datetime.fromtimestamp(past['created_at']):%d %b %Y, %H:%M})")
+        st.session_state.results[task] = {'inputs': inputs, 'result': past['result']}
+        return past['result']
     try:
-        resp = get_model().generate_content(prompt).text
-        text = re.sub(r'```json|```', '', resp).strip()
-        start, end = text.find('{'), text.rfind('}') + 1
-        if start != -1:
-            st.session_state.stats['queries'] += 1
-            return json.loads(text[start:end])
+        results = stream_advisory(task, inputs, state, language) if STREAM_RESPONSES else [generate_advisory(task, inputs, state, language)]
+        for res, complete in results:
+            if res and res != shown:
+                with box.container(): show(res, inputs)
+                shown = res
     except Exception as e:
-        st.error(f"⚠️ AI Parsing Error. Please try again.")
-    return None
+        if task not in OFFLINE_RULES:
+            st.error(f"⚠️ AI Parsing Error. Please try again.")
+            return None
+        res, complete = {**local_fields(task, [inputs])[0], **OFFLINE_RULES[task](inputs, language)}, False
+        with box.container(): show(res, inputs)
+        st.warning("📴 AI service unreachable — showing the offline rules-based analysis.")
+    if not res: return None
+    st.session_state.stats['queries'] += 1
+    st.session_state.results[task] = {'inputs': inputs, 'result': res}
+    render_run_diff(task, inputs, res, store.recent_runs(farmer, task))
+    # Truncated answers and the offline fallback are shown but never saved: history replays
+    # skip the model, so saving them would pin the farmer to a degraded answer.
+    if complete: store.add_run(farmer, task, key, inputs, res)
+    return res
+
+@st.fragment
+@instrumented
+def tool_panel(task: str, form: Callable[[], Optional[Dict[str, Any]]], show: Callable[[Dict, Dict], None], spinner: str):
+    # Form and result panel rerun on their own: a submit doesn't redraw the sidebar or resend
+    # the page CSS. The last result lives in session state, so it is still there after
+    # navigating away and back.
+    inputs = form()
+    if inputs:
+        with st.spinner(spinner): call_ai(task, inputs, show)
+    elif task in st.session_state.results:
+        last = st.session_state.results[task]
+        show(last['result'], last['inputs'])
+
+def render_run_diff(task: str, inputs: Dict[str, Any], res: Dict, previous: List[Dict[str, Any]]):
+    # When exactly one input changed since an earlier run, show what that change did.
+    prev = next((r for r in previous if len(diff_inputs(r['inputs'], inputs)) == 1), None)
+    if not prev: return
+    field = diff_inputs(prev['inputs'], inputs)[0]
+    with st.expander(f"🔁 What changed since {datetime.fromtimestamp(prev['created_at']):%d %b} — {field}: {prev['inputs'].get(field)} → {inputs[field]}"):
+        for name, old, new in diff_results(prev['result'], res):
+            fmt = lambda v: "<br>".join(map(str, v)) if isinstance(v, list) else v
+            st.markdown(f"<div class='card'><b>{name.replace('_', ' ').title()}</b><div style='display:flex; gap:20px;'><div style='flex:1; opacity:0.6;'>{fmt(old)}</div><div style='flex:1;'>{fmt(new)}</div></div></div>", unsafe_allow_html=True)
 
 def render_confidence_bar(score: int):
     color = "#27AE60" if score >= 80 else "#E67E22" if score >= 50 else "#C0392B"
@@ -66,18 +1103,25 @@ def render_confidence_bar(score: int):
     </div>""", unsafe_allow_html=True)
 
 # ── CSS ─────────────────────────────────────────────────────────────────────
-def inject_css():
-    st.markdown("""
+# Fonts are self-hosted: Streamlit's static file server (see .streamlit/config.toml) serves the
+# OFL woff2 files in static/fonts from the app's own origin, so there is no third-party
+# stylesheet or font request. A face whose file is missing falls back to the next font in
+# the stack. The stylesheet is built once per process, not on every rerun.
+FONT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "static", "fonts")
+FONT_FILES = {('Playfair Display', 700): 'PlayfairDisplay-Bold.woff2', ('Playfair Display', 900): 'PlayfairDisplay-Black.woff2',
+              ('Nunito Sans', 300): 'NunitoSans-Light.woff2', ('Nunito Sans', 400): 'NunitoSans-Regular.woff2',
+              ('Nunito Sans', 600): 'NunitoSans-SemiBold.woff2', ('Nunito Sans', 700): 'NunitoSans-Bold.woff2'}
+PAGE_CSS = """
     <style>
-    @import url('https://fonts.googleapis.com/css2?family=Playfair+Display:wght@700;900&family=Nunito+Sans:wght@300;400;600;700&display=swap');
+    /* fonts */
     :root { --soil: #1A0F07; --wheat: #E8C97A; --cream: #FDF6E3; --sage: #4A7C59; }
     [data-testid="stSidebarNav"] + div { display: none !important; }
     button[title="Collapse sidebar"] { color: var(--wheat) !important; }
-    html, body, [data-testid="stAppViewContainer"] { background: #121212 !important; color: var(--cream) !important; font-family: 'Nunito Sans', sans-serif;}
-    h1, h2, h3 { font-family: 'Playfair Display', serif !important; color: var(--wheat) !important; }
+    html, body, [data-testid="stAppViewContainer"] { background: #121212 !important; color: var(--cream) !important; font-family: 'Nunito Sans', system-ui, 'Segoe UI', Roboto, sans-serif;}
+    h1, h2, h3 { font-family: 'Playfair Display', Georgia, 'Times New Roman', serif !important; color: var(--wheat) !important; }
     
     .hero-container { display: flex; flex-direction: column; align-items: center; justify-content: center; text-align: center; min-height: 50vh; margin-top: 5vh; }
-    .hero-title { font-family: 'Playfair Display', serif !important; font-size: 4.5rem !important; color: var(--wheat) !important; margin: 0 !important; }
+    .hero-title { font-family: 'Playfair Display', Georgia, 'Times New Roman', serif !important; font-size: 4.5rem !important; color: var(--wheat) !important; margin: 0 !important; }
     
     .card { background: rgba(255,255,255,0.03); border: 1px solid rgba(255,255,255,0.1); border-radius: 15px; padding: 25px; margin-bottom: 15px; }
     .feature-card { background: rgba(255,255,255,0.02); border: 1px solid rgba(255,255,255,0.1); border-radius: 20px; padding: 20px; text-align: center; transition: 0.3s; height: 100%; }
@@ -89,50 +1133,78 @@ def inject_css():
     .stButton>button { background: transparent !important; border: 2px solid var(--wheat) !important; color: var(--wheat) !important; border-radius: 50px !important; font-weight: 700 !important; transition: 0.3s; }
     .stButton>button:hover { background: var(--wheat) !important; color: var(--soil) !important; box-shadow: 0 0 15px rgba(232,201,122,0.3); }
     </style>
-    """, unsafe_allow_html=True)
+    """
+
+def font_css() -> str:
+    return " ".join(f"@font-face {{ font-family: '{family}'; font-weight: {weight}; font-display: swap; "
+                    f"src: local('{family}'), url('app/static/fonts/{file}') format('woff2'); }}"
+                    for (family, weight), file in FONT_FILES.items() if os.path.exists(os.path.join(FONT_DIR, file)))
+
+@st.cache_resource
+def page_css() -> str:
+    # Whitespace-collapsed once here: this block is resent on every full rerun.
+    return " ".join(PAGE_CSS.replace("/* fonts */", font_css()).split())
+
+def inject_css():
+    st.markdown(page_css(), unsafe_allow_html=True)
+
+# Card templates shared by the result panels.
+CARD_LIST = "<div class='card'{style}><h4>{title}</h4><{tag}>{items}</{tag}></div>"
+CARD_TEXT = "<div class='card'><h4>{title}</h4><p>{text}</p></div>"
+
+def card_list(title: str, items: List[str], tag: str = 'ul', style: str = '', item_style: str = '') -> str:
+    li = f"<li style='{item_style}'>" if item_style else "<li>"
+    return CARD_LIST.format(style=f" style='{style}'" if style else '', title=title, tag=tag, items="".join(f"{li}{i}</li>" for i in items))
 
 # ── ONBOARDING PAGES ────────────────────────────────────────────────────────
+# Buttons change pages through on_click callbacks, which run before the script does, so a
+# click costs one rerun instead of two (click, then st.rerun()).
+def go_to(**state):
+    st.session_state.update(state)
+
+def finish_onboarding(lang: str):
+    st.session_state.update({'language': lang, 'onboarding_complete': True, 'nav': 'home'})
+    get_history_store().save_profile(get_farmer_id(), st.session_state.country, st.session_state.state, lang)
+
 def page_hero():
     st.markdown("<div class='hero-container'><div style='font-size:6rem;'>🌿</div><h1 class='hero-title'>AgSaathi</h1><p style='font-size:1.4rem; opacity:0.7;'>Your Intelligent Agricultural Companion</p></div>", unsafe_allow_html=True)
     col1, col2, col3 = st.columns([1, 1, 1])
     with col2:
-        if st.button("🚀 GET STARTED", use_container_width=True):
-            st.session_state.page = 'country'; st.rerun()
+        st.button("🚀 GET STARTED", use_container_width=True, on_click=go_to, kwargs={'page': 'country'})
 
 def page_country():
     st.markdown("<h1 style='text-align:center; padding-top:50px;'>Where is your farm?</h1>", unsafe_allow_html=True)
     cols = st.columns(3)
     for i, c in enumerate(['India 🇮🇳', 'Canada 🇨🇦', 'Ghana 🇬🇭']):
         with cols[i]:
-            if st.button(c, use_container_width=True):
-                st.session_state.country, st.session_state.page = c, 'state'; st.rerun()
+            st.button(c, use_container_width=True, on_click=go_to, kwargs={'country': c, 'page': 'state'})
 
 def page_state():
     st.markdown(f"<h1 style='text-align:center; padding-top:50px;'>Region in {st.session_state.country}</h1>", unsafe_allow_html=True)
     col1, col2, col3 = st.columns([1, 2, 1])
     with col2:
         sel = st.selectbox("Search State/Province", options=GEO[st.session_state.country]['states'], index=None)
-        if st.button("CONFIRM LOCATION", disabled=not sel, use_container_width=True):
-            st.session_state.state, st.session_state.page = sel, 'language'; st.rerun()
+        st.button("CONFIRM LOCATION", disabled=not sel, use_container_width=True, on_click=go_to, kwargs={'state': sel, 'page': 'language'})
 
 def page_language():
     st.markdown("<h1 style='text-align:center; padding-top:50px;'>Preferred Language</h1>", unsafe_allow_html=True)
     cols = st.columns([1, 1, 1])
     for i, lang in enumerate(GEO[st.session_state.country]['languages']):
         with cols[i % 3]:
-            if st.button(lang, use_container_width=True):
-                st.session_state.update({'language': lang, 'onboarding_complete': True, 'nav': 'home'}); st.rerun()
+            st.button(lang, use_container_width=True, on_click=finish_onboarding, args=(lang,))
 
+@instrumented
 def sidebar():
     with st.sidebar:
         st.markdown("<h1 style='text-align:center; color:var(--wheat); margin-bottom:0;'>🌿 AgSaathi</h1>", unsafe_allow_html=True)
         st.markdown(f"<p style='text-align:center; opacity:0.6;'>📍 {st.session_state.state} | 🌐 {st.session_state.language}</p><hr>", unsafe_allow_html=True)
-        navs = [('home','⌂','Dashboard'), ('crop_rec','🌾','Crop Rec'), ('pest','🐛','Pest'), ('weather','🌦','Weather'), ('soil','🧪','Soil'), ('sustainable','♻️','Sustainable')]
+        navs = [('home','⌂','Dashboard'), ('crop_rec','🌾','Crop Rec'), ('pest','🐛','Pest'), ('weather','🌦','Weather'), ('soil','🧪','Soil'), ('sustainable','♻️','Sustainable'), ('batch','📦','Batch'), ('history','🕘','History')]
+        if is_admin(): navs.append(('admin','📊','Metrics'))
         for k, i, l in navs:
-            if st.button(f"{i} {l}", key=f"nav_{k}", use_container_width=True):
-                st.session_state.nav = k; st.rerun()
+            st.button(f"{i} {l}", key=f"nav_{k}", use_container_width=True, on_click=go_to, kwargs={'nav': k})
         st.markdown("<hr>", unsafe_allow_html=True); st.caption("Aditya Sahani | Reg 1000414")
 
+@instrumented
 def render_home():
     sidebar()
     st.markdown(f"<h1 style='text-align:center;'>Welcome, Farmer</h1><p style='text-align:center; opacity:0.6;'>Hyper-local tools for <b>{st.session_state.state}</b></p><br>", unsafe_allow_html=True)
@@ -141,180 +1213,425 @@ def render_home():
     for i, (k, icon, l) in enumerate(feats):
         with f_cols[i]:
             st.markdown(f"<div class='feature-card'><div style='font-size:2.5rem;'>{icon}</div><b>{l}</b></div>", unsafe_allow_html=True)
-            if st.button("OPEN", key=f"go_{k}", use_container_width=True): st.session_state.nav = k; st.rerun()
+            st.button("OPEN", key=f"go_{k}", use_container_width=True, on_click=go_to, kwargs={'nav': k})
 
 # ── 1. CROP RECOMMENDATION TAB ──────────────────────────────────────────────
+@instrumented
+def show_crop_rec(res: Dict, inputs: Dict):
+    if 'location_analysis' in res:
+        st.markdown(f"<div class='card'><b>📍 Location & Resource Analysis:</b> {res.get('location_analysis')}</div>", unsafe_allow_html=True)
+    for crop in res.get('suggestions', [])[:3]:
+        st.markdown(f"""
+        <div class='card'>
+            <span class='badge risk-{crop.get('risk_level','LOW')}'>{crop.get('risk_level')} Risk</span>
+            <h3 style='margin-top:5px;'>🌾 {crop.get('crop_name')}</h3>
+            <p><b>Why:</b> {crop.get('reason')}</p>
+            <p style='color:var(--wheat);'><b>📈 Market Potential:</b> {crop.get('market_potential')}</p>
+        </div>""", unsafe_allow_html=True)
+    if 'confidence_score' in res:
+        render_confidence_bar(res.get('confidence_score', 80))
+
+@instrumented
 def render_crop_rec():
     sidebar()
     st.markdown("<h1>🌾 Crop Recommendation</h1><p style='opacity:0.7;'>Get region-specific crop suggestions based on your resources.</p>", unsafe_allow_html=True)
     
+    tool_panel('crop_rec', crop_rec_form, show_crop_rec, "Analyzing soil, climate, and market data...")
+
+def crop_rec_form() -> Optional[Dict[str, Any]]:
     with st.form("crop_form"):
         c1, c2, c3, c4 = st.columns(4)
-        budget = c1.text_input("Budget (e.g. $1000 or ₹50000)")
-        water = c2.selectbox("Water Availability", ["Low", "Medium", "High"])
-        soil = c3.selectbox("Soil Type", ["Loamy", "Clay", "Sandy", "Silty", "Peaty", "Saline"])
-        season = c4.selectbox("Season", ["Auto-detect", "Summer", "Monsoon/Rainy", "Winter", "Spring"])
-        goal = st.text_input("Describe your goal", placeholder="e.g. High profit crop for 1 acre in 3 months")
+        budget = c1.text_input("Budget (e.g. $1000 or ₹50000)", key=form_key('crop_rec', 'budget'))
+        water = c2.selectbox("Water Availability", ["Low", "Medium", "High"], key=form_key('crop_rec', 'water'))
+        soil = c3.selectbox("Soil Type", ["Loamy", "Clay", "Sandy", "Silty", "Peaty", "Saline"], key=form_key('crop_rec', 'soil'))
+        season = c4.selectbox("Season", ["Auto-detect", "Summer", "Monsoon/Rainy", "Winter", "Spring"], key=form_key('crop_rec', 'season'))
+        goal = st.text_input("Describe your goal", placeholder="e.g. High profit crop for 1 acre in 3 months", key=form_key('crop_rec', 'goal'))
         submitted = st.form_submit_button("Get Recommendations")
 
-    if submitted and goal:
-        prompt = f"""Language: {st.session_state.language}. Location: {st.session_state.state}. Task: Crop Recommendation.
-        Inputs: Budget: {budget}, Water: {water}, Soil: {soil}, Season: {season}, Goal: "{goal}".
-        JSON format exactly: {{"location_analysis": "string", "suggestions": [{{"crop_name": "string", "reason": "string", "risk_level": "LOW/MEDIUM/HIGH", "market_potential": "string"}}], "confidence_score": 0-100}}"""
-        
-        with st.spinner("Analyzing soil, climate, and market data..."):
-            res = call_ai(prompt)
-            if res:
-                st.markdown(f"<div class='card'><b>📍 Location & Resource Analysis:</b> {res.get('location_analysis')}</div>", unsafe_allow_html=True)
-                for crop in res.get('suggestions', [])[:3]:
-                    st.markdown(f"""
-                    <div class='card'>
-                        <span class='badge risk-{crop.get('risk_level','LOW')}'>{crop.get('risk_level')} Risk</span>
-                        <h3 style='margin-top:5px;'>🌾 {crop.get('crop_name')}</h3>
-                        <p><b>Why:</b> {crop.get('reason')}</p>
-                        <p style='color:var(--wheat);'><b>📈 Market Potential:</b> {crop.get('market_potential')}</p>
-                    </div>""", unsafe_allow_html=True)
-                render_confidence_bar(res.get('confidence_score', 80))
+    return {'budget': budget, 'water': water, 'soil': soil, 'season': season, 'goal': goal} if submitted and goal else None
 
 # ── 2. PEST & DISEASE TAB ───────────────────────────────────────────────────
+@instrumented
+def show_pest(res: Dict, inputs: Dict):
+    if 'diagnosis_result' in res:
+        st.markdown(f"<div class='card'><h3 style='color:#E67E22;'>🩺 Diagnosis: {res.get('diagnosis_result')}</h3></div>", unsafe_allow_html=True)
+    
+    c1, c2 = st.columns(2)
+    with c1:
+        if 'treatment_steps' in res:
+            st.markdown(card_list("🧪 Treatment Steps", res.get('treatment_steps', [])), unsafe_allow_html=True)
+    with c2:
+        if 'organic_option' in res:
+            st.markdown(CARD_TEXT.format(title="🌿 Organic Option", text=res.get('organic_option')), unsafe_allow_html=True)
+    
+    if 'prevention_tip' in res: st.info(f"🛡️ **Prevention:** {res.get('prevention_tip')}")
+    if 'safety_warning' in res: st.error(f"⚠️ **Safety Warning:** {res.get('safety_warning')}")
+    if inputs.get('image'): st.caption(f"📸 Diagnosed with {len(inputs['image'].split(','))} photo(s)")
+
+@instrumented
 def render_pest():
     sidebar()
     st.markdown("<h1>🐛 Pest & Disease Diagnosis</h1>", unsafe_allow_html=True)
     
+    tool_panel('pest', pest_form, show_pest, "Consulting agricultural pathology database...")
+
+def pest_form() -> Optional[Dict[str, Any]]:
     with st.form("pest_form"):
         c1, c2 = st.columns([1, 1])
-        crop_name = c1.text_input("Crop Name", placeholder="e.g. Tomatoes")
-        duration = c2.selectbox("How long since symptoms appeared?", ["Just noticed (1-2 days)", "A few days (3-7 days)", "Over a week", "Several weeks"])
-        symptoms = st.text_area("Describe Symptoms", placeholder="e.g. Yellowing leaves with black spots on the bottom")
-        st.file_uploader("📸 Upload Image (Coming Soon - Future Upgrade)", disabled=True)
+        crop_name = c1.text_input("Crop Name", placeholder="e.g. Tomatoes", key=form_key('pest', 'crop_name'))
+        duration = c2.selectbox("How long since symptoms appeared?", ["Just noticed (1-2 days)", "A few days (3-7 days)", "Over a week", "Several weeks"], key=form_key('pest', 'duration'))
+        symptoms = st.text_area("Describe Symptoms", placeholder="e.g. Yellowing leaves with black spots on the bottom", key=form_key('pest', 'symptoms'))
+        photos = st.file_uploader(f"📸 Upload Photos (up to {IMAGE_MAX_FILES})", type=['jpg', 'jpeg', 'png', 'webp'], accept_multiple_files=True)
         submitted = st.form_submit_button("Diagnose Issue")
 
-    if submitted and symptoms:
-        prompt = f"""Language: {st.session_state.language}. Location: {st.session_state.state}. Task: Pest/Disease Diagnosis.
-        Crop: {crop_name}. Symptoms: {symptoms}. Duration: {duration}.
-        JSON exactly: {{"diagnosis_result": "string", "treatment_steps": ["step1", "step2"], "organic_option": "string", "prevention_tip": "string", "safety_warning": "string"}}"""
-        
-        with st.spinner("Consulting agricultural pathology database..."):
-            res = call_ai(prompt)
-            if res:
-                st.markdown(f"<div class='card'><h3 style='color:#E67E22;'>🩺 Diagnosis: {res.get('diagnosis_result')}</h3></div>", unsafe_allow_html=True)
-                
-                c1, c2 = st.columns(2)
-                with c1:
-                    st.markdown("<div class='card'><h4>🧪 Treatment Steps</h4><ul>" + "".join([f"<li>{s}</li>" for s in res.get('treatment_steps',[])]) + "</ul></div>", unsafe_allow_html=True)
-                with c2:
-                    st.markdown(f"<div class='card'><h4>🌿 Organic Option</h4><p>{res.get('organic_option')}</p></div>", unsafe_allow_html=True)
-                
-                st.info(f"🛡️ **Prevention:** {res.get('prevention_tip')}")
-                st.error(f"⚠️ **Safety Warning:** {res.get('safety_warning')}")
+    if not (submitted and (symptoms or photos)): return None
+    inputs = {'crop_name': crop_name, 'symptoms': symptoms, 'duration': duration}
+    if photos:
+        with st.spinner("Preparing photos..."):
+            ids, failed = ingest_photos(photos, (st.session_state.state, ' '.join(crop_name.split()).lower()))
+        if failed: st.warning(f"Couldn't read {', '.join(failed)} — diagnosing without it.")
+        if ids: inputs['image'] = ','.join(ids)
+    return inputs if symptoms or 'image' in inputs else None
 
 # ── 3. WEATHER ALERTS TAB ───────────────────────────────────────────────────
+@instrumented
+def show_weather(res: Dict, inputs: Dict):
+    if 'risk_level' in res:
+        st.markdown(f"<div class='card'><span class='badge risk-{res.get('risk_level','HIGH')}'>{res.get('risk_level')} RISK TO {inputs['crop'].upper()}</span><h3>📉 Yield Impact Estimate</h3><p>{res.get('yield_impact_estimate', '…')}</p></div>", unsafe_allow_html=True)
+    
+    c1, c2 = st.columns(2)
+    with c1:
+        if 'immediate_actions' in res:
+            st.markdown(card_list("🚨 Immediate Actions (Next 24 Hrs)", res.get('immediate_actions', []), style="border-left:4px solid #C0392B;"), unsafe_allow_html=True)
+    with c2:
+        if 'short_term_actions' in res:
+            st.markdown(card_list("📅 Short-term Actions (Next 7 Days)", res.get('short_term_actions', []), style="border-left:4px solid #E67E22;"), unsafe_allow_html=True)
+
+@instrumented
 def render_weather():
     sidebar()
     st.markdown("<h1>🌦 Smart Weather Alerts</h1>", unsafe_allow_html=True)
     
+    tool_panel('weather', weather_form, show_weather, "Calculating climatic impact...")
+
+def weather_form() -> Optional[Dict[str, Any]]:
     with st.form("weather_form"):
         c1, c2, c3 = st.columns(3)
-        current_weather = c1.text_input("Current Weather", placeholder="e.g. Cloudy, Humid")
-        temp = c2.slider("Temperature (°C)", -10, 50, 30)
-        forecast = c3.selectbox("Upcoming Forecast Risk", ["Heatwave", "Heavy Rain / Flood", "Frost", "Drought / Dry Spell", "High Winds"])
-        crop = st.text_input("Primary Crop Affected", placeholder="e.g. Flowering Wheat")
+        current_weather = c1.text_input("Current Weather", placeholder="e.g. Cloudy, Humid", key=form_key('weather', 'current_weather'))
+        temp = c2.slider("Temperature (°C)", -10, 50, key=form_key('weather', 'temp', WEATHER_DEFAULT_TEMP))
+        forecast = c3.selectbox("Upcoming Forecast Risk", FORECAST_RISKS, key=form_key('weather', 'forecast'))
+        crop = st.text_input("Primary Crop Affected", placeholder="e.g. Flowering Wheat", key=form_key('weather', 'crop'))
         submitted = st.form_submit_button("Generate Action Plan")
 
-    if submitted and crop:
-        prompt = f"""Language: {st.session_state.language}. Location: {st.session_state.state}. Task: Weather Crisis Management.
-        Weather: {current_weather} at {temp}C. Risk: {forecast}. Crop: {crop}.
-        JSON exactly: {{"risk_level": "LOW/MEDIUM/HIGH", "yield_impact_estimate": "string", "immediate_actions": ["24h step1", "24h step2"], "short_term_actions": ["7day step1", "7day step2"]}}"""
-        
-        with st.spinner("Calculating climatic impact..."):
-            res = call_ai(prompt)
-            if res:
-                st.markdown(f"<div class='card'><span class='badge risk-{res.get('risk_level','HIGH')}'>{res.get('risk_level')} RISK TO {crop.upper()}</span><h3>📉 Yield Impact Estimate</h3><p>{res.get('yield_impact_estimate')}</p></div>", unsafe_allow_html=True)
-                
-                c1, c2 = st.columns(2)
-                with c1:
-                    st.markdown("<div class='card' style='border-left:4px solid #C0392B;'><h4>🚨 Immediate Actions (Next 24 Hrs)</h4><ul>" + "".join([f"<li>{s}</li>" for s in res.get('immediate_actions',[])]) + "</ul></div>", unsafe_allow_html=True)
-                with c2:
-                    st.markdown("<div class='card' style='border-left:4px solid #E67E22;'><h4>📅 Short-term Actions (Next 7 Days)</h4><ul>" + "".join([f"<li>{s}</li>" for s in res.get('short_term_actions',[])]) + "</ul></div>", unsafe_allow_html=True)
+    return {'current_weather': current_weather, 'temp': temp, 'forecast': forecast, 'crop': crop} if submitted and crop else None
 
 # ── 4. SOIL HEALTH TAB ──────────────────────────────────────────────────────
+@instrumented
+def show_soil(res: Dict, inputs: Dict):
+    if 'classification' in res or 'crop_compatibility_score' in res:
+        score = res.get('crop_compatibility_score')
+        color = "var(--cream)" if score is None else "#27AE60" if score > 75 else "#E67E22" if score > 40 else "#C0392B"
+        shown = "—<br><small style='opacity:0.6;'>not in our crop table</small>" if score is None else f"{score}/100"
+        
+        c1, c2, c3 = st.columns(3)
+        c1.markdown(f"<div class='card' style='text-align:center;'><h4>Classification</h4><h2 style='color:var(--wheat);'>{res.get('classification', '…')}</h2></div>", unsafe_allow_html=True)
+        c2.markdown(f"<div class='card' style='text-align:center;'><h4>Compatibility for {inputs['target_crop']}</h4><h2 style='color:{color};'>{shown}</h2></div>", unsafe_allow_html=True)
+        c3.markdown(f"<div class='card' style='text-align:center;'><h4>Organic Matter</h4><h2>{inputs['om']}%</h2></div>", unsafe_allow_html=True)
+    
+    if 'nutrient_balance_summary' in res:
+        st.markdown(CARD_TEXT.format(title="⚖️ Nutrient Balance Summary", text=res.get('nutrient_balance_summary')), unsafe_allow_html=True)
+    if 'amendment_recommendations' in res:
+        st.markdown(card_list("💊 Amendment Recommendations", res.get('amendment_recommendations', [])), unsafe_allow_html=True)
+
+@instrumented
 def render_soil():
     sidebar()
     st.markdown("<h1>🧪 Soil Health & Nutrients</h1>", unsafe_allow_html=True)
     
+    tool_panel('soil', soil_form, show_soil, "Processing chemical profile...")
+
+def soil_form() -> Optional[Dict[str, Any]]:
     with st.form("soil_form"):
         c1, c2 = st.columns(2)
-        ph = c1.slider("Soil pH", 0.0, 14.0, 6.5, 0.1)
-        om = c1.slider("Organic Matter (%)", 0.0, 10.0, 2.5, 0.1)
-        target_crop = c1.text_input("Target Crop", placeholder="e.g. Potatoes")
+        ph = c1.slider("Soil pH", 0.0, 14.0, step=0.1, key=form_key('soil', 'ph', 6.5))
+        om = c1.slider("Organic Matter (%)", 0.0, 10.0, step=0.1, key=form_key('soil', 'om', 2.5))
+        target_crop = c1.text_input("Target Crop", placeholder="e.g. Potatoes", key=form_key('soil', 'target_crop'))
         
-        n = c2.select_slider("Nitrogen (N)", ["Very Low", "Low", "Medium", "High", "Excessive"], value="Medium")
-        p = c2.select_slider("Phosphorus (P)", ["Very Low", "Low", "Medium", "High", "Excessive"], value="Medium")
-        k = c2.select_slider("Potassium (K)", ["Very Low", "Low", "Medium", "High", "Excessive"], value="Medium")
+        n = c2.select_slider("Nitrogen (N)", NPK_LEVELS, key=form_key('soil', 'n', "Medium"))
+        p = c2.select_slider("Phosphorus (P)", NPK_LEVELS, key=form_key('soil', 'p', "Medium"))
+        k = c2.select_slider("Potassium (K)", NPK_LEVELS, key=form_key('soil', 'k', "Medium"))
         submitted = st.form_submit_button("Analyze Soil Profile")
 
-    if submitted:
-        prompt = f"""Language: {st.session_state.language}. Location: {st.session_state.state}. Task: Soil Analysis.
-        Data: pH: {ph}, OM: {om}%, N: {n}, P: {p}, K: {k}. Target Crop: {target_crop}.
-        JSON exactly: {{"classification": "Acidic/Neutral/Alkaline", "nutrient_balance_summary": "string", "crop_compatibility_score": 0-100, "amendment_recommendations": ["rec1", "rec2"]}}"""
-        
-        with st.spinner("Processing chemical profile..."):
-            res = call_ai(prompt)
-            if res:
-                score = res.get('crop_compatibility_score', 50)
-                color = "#27AE60" if score > 75 else "#E67E22" if score > 40 else "#C0392B"
-                
-                c1, c2, c3 = st.columns(3)
-                c1.markdown(f"<div class='card' style='text-align:center;'><h4>Classification</h4><h2 style='color:var(--wheat);'>{res.get('classification')}</h2></div>", unsafe_allow_html=True)
-                c2.markdown(f"<div class='card' style='text-align:center;'><h4>Compatibility for {target_crop}</h4><h2 style='color:{color};'>{score}/100</h2></div>", unsafe_allow_html=True)
-                c3.markdown(f"<div class='card' style='text-align:center;'><h4>Organic Matter</h4><h2>{om}%</h2></div>", unsafe_allow_html=True)
-                
-                st.markdown(f"<div class='card'><h4>⚖️ Nutrient Balance Summary</h4><p>{res.get('nutrient_balance_summary')}</p></div>", unsafe_allow_html=True)
-                st.markdown("<div class='card'><h4>💊 Amendment Recommendations</h4><ul>" + "".join([f"<li>{s}</li>" for s in res.get('amendment_recommendations',[])]) + "</ul></div>", unsafe_allow_html=True)
+    return {'ph': ph, 'om': om, 'n': n, 'p': p, 'k': k, 'target_crop': target_crop} if submitted else None
 
 # ── 5. SUSTAINABLE FARMING TAB ──────────────────────────────────────────────
+@instrumented
+def show_sustainable(res: Dict, inputs: Dict):
+    if 'vision_statement' in res:
+        st.markdown(f"<div class='card' style='border: 1px solid var(--sage); background:rgba(74,124,89,0.1);'><h3 style='color:var(--sage);'>🌍 Vision</h3><p>{res.get('vision_statement')}</p></div>", unsafe_allow_html=True)
+    
+    c1, c2 = st.columns([2, 1])
+    with c1:
+        if 'implementation_steps' in res:
+            st.markdown(card_list("⚙️ Step-by-Step Implementation", res.get('implementation_steps', []), tag='ol', item_style="margin-bottom:10px;"), unsafe_allow_html=True)
+    with c2:
+        if 'expected_roi_time' in res:
+            st.markdown(f"<div class='card'><h4>⏳ Expected ROI Time</h4><p style='font-size:1.2rem; color:var(--wheat); font-weight:bold;'>{res.get('expected_roi_time')}</p></div>", unsafe_allow_html=True)
+        if 'environmental_impact' in res:
+            st.markdown(CARD_TEXT.format(title="🌱 Environmental Impact", text=res.get('environmental_impact')), unsafe_allow_html=True)
+
+@instrumented
 def render_sustainable():
     sidebar()
     st.markdown("<h1>♻️ Forward-Thinking Sustainability</h1><p style='opacity:0.7;'>Modernize your farm for the future.</p>", unsafe_allow_html=True)
     
+    tool_panel('sustainable', sustainable_form, show_sustainable, "Designing sustainable architecture...")
+
+def sustainable_form() -> Optional[Dict[str, Any]]:
     with st.form("sus_form"):
         c1, c2, c3 = st.columns(3)
-        practice = c1.selectbox("Select Innovation Practice", ["Drip/Precision Irrigation", "Organic Composting System", "Crop Rotation & Cover Crops", "Zero Tillage Farming", "Solar Water Pumps"])
-        farm_size = c2.text_input("Farm Size", placeholder="e.g. 5 Acres")
-        budget = c3.text_input("Available Budget", placeholder="e.g. $2000")
+        practice = c1.selectbox("Select Innovation Practice", PRACTICES, key=form_key('sustainable', 'practice'))
+        farm_size = c2.text_input("Farm Size", placeholder="e.g. 5 Acres", key=form_key('sustainable', 'farm_size'))
+        budget = c3.text_input("Available Budget", placeholder="e.g. $2000", key=form_key('sustainable', 'budget'))
         submitted = st.form_submit_button("Generate Implementation Plan")
 
-    if submitted:
-        prompt = f"""Language: {st.session_state.language}. Location: {st.session_state.state}. Task: Sustainable Farm Implementation.
-        Practice: {practice}. Farm Size: {farm_size}. Budget: {budget}.
-        JSON exactly: {{"vision_statement": "string", "implementation_steps": ["step1", "step2", "step3"], "expected_roi_time": "string", "environmental_impact": "string", "confidence_score": 0-100}}"""
+    return {'practice': practice, 'farm_size': farm_size, 'budget': budget} if submitted else None
+
+# ── 6. BATCH ADVISORY TAB ───────────────────────────────────────────────────
+# For extension officers: one upload of many farm profiles → deduped, cache-checked, packed
+# several profiles per prompt and fanned out in parallel through the model client.
+BATCH_COLUMNS = {'soil': ['ph', 'om', 'n', 'p', 'k', 'target_crop'], 'crop_rec': ['budget', 'water', 'soil', 'season', 'goal']}
+BATCH_TITLES = {'soil': 'Soil Analysis', 'crop_rec': 'Crop Recommendation'}
+BATCH_PACK_SIZE = {'soil': 5, 'crop_rec': 3}
+BATCH_MAX_ROWS = 2000
+BATCH_REDRAW_S = 2.0  # the live results table is redrawn at most this often; the progress bar on every pack
+BATCH_PROMPT = """Language: {language}. Location: {state}. Task: {title} for several farms.
+        Farm profiles (JSON list, one object per farm): {profiles}
+        Return JSON exactly: {{"results": [one result per farm, in the same order, each shaped as {shape}]}}"""
+
+def read_batch_rows(name: str, data: bytes, task: str) -> Tuple[List[Dict[str, Any]], int]:
+    """Returns (rows, dropped): rows past BATCH_MAX_ROWS are dropped. Raises ValueError naming the bad row."""
+    text = data.decode('utf-8-sig')
+    raw = [json.loads(line) for line in text.splitlines() if line.strip()] if name.lower().endswith('.jsonl') else list(csv.DictReader(io.StringIO(text)))
+    missing = sorted({c for r in raw for c in BATCH_COLUMNS[task] if c not in r})
+    if missing: raise ValueError(f"missing columns: {', '.join(missing)}")
+    levels = {l.lower(): l for l in NPK_LEVELS}
+    rows = []
+    for i, r in enumerate(raw[:BATCH_MAX_ROWS], 1):
+        row = {c: str(r[c] if r[c] is not None else '').strip() for c in BATCH_COLUMNS[task]}
+        for c in ('ph', 'om'):
+            if c not in row: continue
+            try:
+                row[c] = float(row[c])
+            except ValueError:
+                raise ValueError(f"row {i}: {c} must be a number, got {row[c]!r}") from None
+            if not math.isfinite(row[c]) or row[c] < 0: raise ValueError(f"row {i}: {c} must be a non-negative number, got {row[c]:g}")
+        for c in ('n', 'p', 'k'):
+            if c not in row: continue
+            if row[c].lower() not in levels: raise ValueError(f"row {i}: {c} must be one of {', '.join(NPK_LEVELS)}, got {row[c]!r}")
+            row[c] = levels[row[c].lower()]
+        rows.append(row)
+    return rows, max(0, len(raw) - BATCH_MAX_ROWS)
+
+def batch_prompt(task: str, profiles: List[Dict[str, Any]], state: str, language: str) -> str:
+    shape = PROMPTS[task].split('exactly: ', 1)[1].format()
+    return BATCH_PROMPT.format(language=language, state=state, title=BATCH_TITLES[task], profiles=json.dumps(profiles, ensure_ascii=False), shape=shape)
+
+def run_batch(task: str, rows: List[Dict[str, Any]], keys: List[str], state: str, language: str,
+              on_progress: Callable[[Dict[str, Dict], Dict[str, str]], None]) -> Tuple[Dict[str, Dict], Dict[str, str]]:
+    """Returns (results, settled): settled maps keys the model did not answer to 'offline' (rule-based result) or 'failed'."""
+    cache, metrics, parse_metrics, client = get_response_cache(), get_metrics(), get_parse_metrics(), get_model()
+    unique = dict(zip(keys, rows))
+    results, settled, pending = {}, {}, []
+    for k in unique:
+        hit = cached_advisory(task, k, unique[k], state, language)
+        if hit is None: pending.append(k)
+        else: results[k] = hit
+    on_progress(results, settled)
+
+    local = dict(zip(pending, local_fields(task, [unique[k] for k in pending])))
+    size = BATCH_PACK_SIZE.get(task, 1)
+    packs = [pending[i:i + size] for i in range(0, len(pending), size)]
+    config = structured_config({'type': 'object', 'properties': {'results': _list(SCHEMAS[task])}, 'required': ['results']})
+    # Each pack is timed from leaving the client's queue to its answer, not from the fan-out start.
+    started, finished = {}, {}
+    futures = {}
+    for i, p in enumerate(packs):
+        fut = client.submit(batch_prompt(task, [{**unique[k], **local[k]} for k in p], state, language), config,
+                            on_start=functools.partial(lambda i: started.setdefault(i, time.perf_counter()), i))
+        fut.add_done_callback(functools.partial(lambda i, f: finished.setdefault(i, time.perf_counter()), i))
+        futures[fut] = (i, p)
+    leftovers = []
+    for fut in concurrent.futures.as_completed(futures):
+        (n, pack), items = futures[fut], []
+        try:
+            resp = fut.result()
+            metrics.observe_model(task, finished.get(n, time.perf_counter()) - started[n], resp, stage='batch')
+            items = (parse_partial_json(resp.text) or {}).get('results', [])
+        except google_exceptions.InvalidArgument as e:
+            parse_metrics.reject_schema(e)
+        except Exception:
+            pass
+        for i, k in enumerate(pack):
+            res, missing = validate_response(items[i], SCHEMAS[task]) if i < len(items) and isinstance(items[i], dict) else ({}, ['*'])
+            if missing:
+                leftovers.append(k); continue
+            results[k] = {**local[k], **res}; cache.put(task, k, results[k])
+            metrics.inc('agsaathi_parse_total', task=task, outcome='batch')
+        on_progress(results, settled)
+
+    # Profiles a packed answer did not cover go out as ordinary single requests (with repair/re-ask).
+    prompts = {k: build_prompt(task, unique[k], state, language) for k in leftovers}
+    futures = {client.submit(prompts[k], structured_config(SCHEMAS[task])): k for k in leftovers}
+    for fut in concurrent.futures.as_completed(futures):
+        k = futures[fut]
+        try:
+            res, complete = finalize_response(task, prompts[k], fut.result().text)
+        except Exception:
+            res, complete = OFFLINE_RULES[task](unique[k], language) if task in OFFLINE_RULES else None, False
+        if res: results[k] = {**local[k], **res}
+        if complete: cache.put(task, k, results[k])
+        else: settled[k] = 'offline' if res else 'failed'
+        on_progress(results, settled)
+    return results, settled
+
+def flatten_result(res: Dict) -> Dict[str, Any]:
+    flat = {}
+    for k, v in res.items():
+        if isinstance(v, list): v = "; ".join(" / ".join(str(x) for x in i.values()) if isinstance(i, dict) else str(i) for i in v)
+        flat[k] = v
+    return flat
+
+def batch_table(task: str, rows: List[Dict[str, Any]], keys: List[str], results: Dict[str, Dict], settled: Dict[str, str]) -> List[Dict[str, Any]]:
+    status = lambda k: settled.get(k) or ('done' if k in results else 'pending')
+    return [{'#': i + 1, **row, 'status': status(k), **flatten_result(results.get(k, {}))} for i, (row, k) in enumerate(zip(rows, keys))]
+
+def table_csv(table: List[Dict[str, Any]]) -> str:
+    out, fields = io.StringIO(), list(dict.fromkeys(f for r in table for f in r))
+    writer = csv.DictWriter(out, fieldnames=fields)
+    writer.writeheader(); writer.writerows(table)
+    return out.getvalue()
+
+@instrumented
+def render_batch():
+    sidebar()
+    st.markdown("<h1>📦 Batch Advisory</h1><p style='opacity:0.7;'>Run hundreds of farm profiles through one tool in a single job.</p>", unsafe_allow_html=True)
+    
+    c1, c2 = st.columns([1, 2])
+    task = c1.selectbox("Tool", list(BATCH_COLUMNS), format_func=lambda t: BATCH_TITLES[t])
+    c2.markdown(f"<div class='card'><b>Required columns:</b> {', '.join(BATCH_COLUMNS[task])}</div>", unsafe_allow_html=True)
+    upload = st.file_uploader("Upload farm profiles (CSV or JSONL)", type=['csv', 'jsonl'])
+    
+    if upload and st.button("Run Batch"):
+        try:
+            rows, dropped = read_batch_rows(upload.name, upload.getvalue(), task)
+        except (ValueError, KeyError) as e:
+            st.error(f"⚠️ Could not read file: {e}"); return
+        if dropped: st.warning(f"⚠️ Only the first {BATCH_MAX_ROWS} farm profiles are processed per batch; {dropped} rows were skipped. Split the file to run them.")
+        state, language = st.session_state.state, st.session_state.language
+        keys = [cache_key(task, r, state, language) for r in rows]
+        total = len(set(keys))
+        progress, table = st.progress(0.0, text="Starting..."), st.empty()
+        drawn = [0.0]
         
-        with st.spinner("Designing sustainable architecture..."):
-            res = call_ai(prompt)
-            if res:
-                st.markdown(f"<div class='card' style='border: 1px solid var(--sage); background:rgba(74,124,89,0.1);'><h3 style='color:var(--sage);'>🌍 Vision</h3><p>{res.get('vision_statement')}</p></div>", unsafe_allow_html=True)
-                
-                c1, c2 = st.columns([2, 1])
-                with c1:
-                    st.markdown("<div class='card'><h4>⚙️ Step-by-Step Implementation</h4><ol>" + "".join([f"<li style='margin-bottom:10px;'>{s}</li>" for s in res.get('implementation_steps',[])]) + "</ol></div>", unsafe_allow_html=True)
-                with c2:
-                    st.markdown(f"<div class='card'><h4>⏳ Expected ROI Time</h4><p style='font-size:1.2rem; color:var(--wheat); font-weight:bold;'>{res.get('expected_roi_time')}</p></div>", unsafe_allow_html=True)
-                    st.markdown(f"<div class='card'><h4>🌱 Environmental Impact</h4><p>{res.get('environmental_impact')}</p></div>", unsafe_allow_html=True)
+        def on_progress(results: Dict[str, Dict], settled: Dict[str, str]):
+            finished = len(results.keys() | settled.keys())
+            progress.progress(finished / total if total else 1.0, text=f"{finished}/{total} unique profiles ({len(rows) - total} duplicates skipped)")
+            # Rebuilding a table of up to BATCH_MAX_ROWS rows after every pack swamps the websocket; throttle it.
+            if time.monotonic() - drawn[0] >= BATCH_REDRAW_S:
+                table.dataframe(batch_table(task, rows, keys, results, settled), use_container_width=True)
+                drawn[0] = time.monotonic()
+        
+        results, settled = run_batch(task, rows, keys, state, language, on_progress)
+        st.session_state.stats['queries'] += len(results)
+        st.session_state.batch = {'task': task, 'table': batch_table(task, rows, keys, results, settled)}
+        table.empty()
+    
+    if st.session_state.batch:
+        batch = st.session_state.batch
+        counts = {s: sum(r['status'] == s for r in batch['table']) for s in ('done', 'offline', 'failed')}
+        extra = "".join(f" · {n} {s}" for s, n in counts.items() if s != 'done' and n)
+        st.markdown(f"<div class='card'><b>✅ {BATCH_TITLES[batch['task']]}:</b> {counts['done']}/{len(batch['table'])} farms answered{extra}</div>", unsafe_allow_html=True)
+        st.dataframe(batch['table'], use_container_width=True)
+        st.download_button("Download Results (CSV)", table_csv(batch['table']), file_name=f"agsaathi_{batch['task']}_batch.csv", mime="text/csv")
+
+# ── 7. HISTORY TAB ──────────────────────────────────────────────────────────
+TASK_TITLES = {'crop_rec': '🌾 Crop Recommendation', 'pest': '🐛 Pest & Disease', 'weather': '🌦 Weather Alerts', 'soil': '🧪 Soil Health', 'sustainable': '♻️ Sustainable'}
+SHOWS = {'crop_rec': show_crop_rec, 'pest': show_pest, 'weather': show_weather, 'soil': show_soil, 'sustainable': show_sustainable}
+
+@instrumented
+def render_history():
+    sidebar()
+    st.markdown("<h1>🕘 Your Advice History</h1><p style='opacity:0.7;'>Past results open instantly — no new AI call.</p>", unsafe_allow_html=True)
+    
+    task = st.selectbox("Tool", [None, *TASK_TITLES], format_func=lambda t: "All tools" if t is None else TASK_TITLES[t])
+    if st.session_state.get('history_task') != task:
+        st.session_state.history_task, st.session_state.history_page = task, 0
+    runs, total = get_history_store().page(get_farmer_id(), task, st.session_state.history_page)
+    if not runs:
+        st.info("No saved advice yet. Results from every tool are saved here automatically."); return
+    
+    for run in runs:
+        summary = ", ".join(f"{v}" for k, v in run['inputs'].items() if k != 'image' and v not in ('', None))[:90]
+        with st.expander(f"{TASK_TITLES[run['task']]} · {datetime.fromtimestamp(run['created_at']):%d %b %Y, %H:%M} · {summary}"):
+            SHOWS[run['task']](run['result'], run['inputs'])
+            st.button("✏️ Re-run with changes", key=f"rerun_{run['id']}", on_click=go_to,
+                      kwargs={'nav': run['task'], **{f"{run['task']}_{field}": value for field, value in run['inputs'].items()}})
+    
+    pages = (total - 1) // HISTORY_PAGE_SIZE + 1
+    c1, c2, c3 = st.columns([1, 2, 1])
+    c1.button("← Newer", disabled=st.session_state.history_page == 0, use_container_width=True, on_click=go_to, kwargs={'history_page': st.session_state.history_page - 1})
+    c2.markdown(f"<p style='text-align:center; opacity:0.6;'>Page {st.session_state.history_page + 1} of {pages} · {total} results</p>", unsafe_allow_html=True)
+    c3.button("Older →", disabled=st.session_state.history_page >= pages - 1, use_container_width=True, on_click=go_to, kwargs={'history_page': st.session_state.history_page + 1})
+
+# ── ADMIN: METRICS ──────────────────────────────────────────────────────────
+def is_admin() -> bool:
+    # Hidden page: the Metrics nav only appears when the URL carries ?admin=<ADMIN_TOKEN>.
+    return bool(ADMIN_TOKEN) and st.query_params.get('admin') == ADMIN_TOKEN
+
+@instrumented
+def render_admin():
+    sidebar()
+    st.markdown("<h1>📊 Performance Metrics</h1><p style='opacity:0.7;'>Process-wide telemetry since the last restart.</p>", unsafe_allow_html=True)
+    metrics = get_metrics()
+    gauges = metrics.gauges()
+    c1, c2, c3, c4 = st.columns(4)
+    c1.metric("Cache Hit Rate", f"{gauges['cache']['hit_rate']:.0%}", f"{gauges['cache']['entries']} entries", delta_color="off")
+    c2.metric("Parse Success", f"{gauges['parse']['success_rate']:.0%}", f"{gauges['parse']['repair_rate']:.0%} repaired", delta_color="off")
+    c3.metric("Model Calls", gauges['model_client']['calls'], f"{gauges['model_client']['coalesced']} coalesced", delta_color="off")
+    c4.metric("Retries / Timeouts", f"{gauges['model_client']['retries']} / {gauges['model_client']['timeouts']}")
+    c1, c2, c3, c4 = st.columns(4)
+    photos = {r['metric']: r for r in metrics.summary_rows() if r['metric'].startswith('agsaathi_image_')}
+    if photos:
+        c1.metric("Photo Upload (p50)", f"{photos['agsaathi_image_upload_bytes']['p50'] / 1024:.0f} KiB")
+        c2.metric("Sent to Model (p50)", f"{photos['agsaathi_image_encoded_bytes']['p50'] / 1024:.0f} KiB")
+        c3.metric("Photo Encode (p95)", f"{photos['agsaathi_image_encode_seconds']['p95'] * 1000:.0f} ms")
+    c4.metric("Photo Dedupe Hit Rate", f"{gauges['images']['dedupe_hit_rate']:.0%}", f"{gauges['images']['dedupe_hits']} reused", delta_color="off")
+    st.markdown("<h3>⏱️ Latency &amp; Sizes</h3>", unsafe_allow_html=True)
+    st.dataframe(sorted(metrics.summary_rows(), key=lambda r: (r['unit'] != 'seconds', r['unit'], -r['p95'])), use_container_width=True)
+    prom = metrics.prometheus()
+    st.download_button("Download Prometheus Metrics", prom, file_name="agsaathi_metrics.txt")
+    with st.expander("Prometheus text"): st.code(prom, language="text")
 
 # ── MAIN ROUTER ─────────────────────────────────────────────────────────────
 def main():
-    inject_css()
-    if not st.session_state.onboarding_complete:
-        pages = {'hero': page_hero, 'country': page_country, 'state': page_state, 'language': page_language}
-        pages.get(st.session_state.page, page_hero)()
-    else:
-        nav = st.session_state.nav
-        if nav == 'home': render_home()
-        elif nav == 'crop_rec': render_crop_rec()
-        elif nav == 'pest': render_pest()
-        elif nav == 'weather': render_weather()
-        elif nav == 'soil': render_soil()
-        elif nav == 'sustainable': render_sustainable()
+    with get_metrics().timer('agsaathi_script_run_seconds', page=st.session_state.nav if st.session_state.onboarding_complete else st.session_state.page):
+        inject_css()
+        if not st.session_state.profile_checked: restore_profile()
+        if not st.session_state.onboarding_complete:
+            pages = {'hero': page_hero, 'country': page_country, 'state': page_state, 'language': page_language}
+            pages.get(st.session_state.page, page_hero)()
+        else:
+            nav = st.session_state.nav
+            if nav == 'home': render_home()
+            elif nav == 'crop_rec': render_crop_rec()
+            elif nav == 'pest': render_pest()
+            elif nav == 'weather': render_weather()
+            elif nav == 'soil': render_soil()
+            elif nav == 'sustainable': render_sustainable()
+            elif nav == 'batch': render_batch()
+            elif nav == 'history': render_history()
+            elif nav == 'admin' and is_admin(): render_admin()
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,153 @@
+"""
+AgSaathi — offline load & latency benchmark.
+Drives app.py with Streamlit's AppTest through onboarding and every tool form, with the
+Gemini model replaced by fake_model.FakeModel, and reports script-run latency percentiles,
+peak-RSS growth per session and model calls per submit.
+
+    python bench.py --sessions 50 --concurrency 10 --latency 0.5 --max-p95 3.0
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+import resource
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Callable
+
+APP = os.path.join(os.path.dirname(os.path.abspath(__file__)), "app.py")
+
+# Form fillers per tool — inputs vary with the session's profile index so
+# cache and coalescing behave like a real mix of repeat and unique queries.
+TOOLS: Dict[str, Callable] = {
+    'crop_rec': lambda at, i: _by_label(at.text_input, "Describe your goal").input(f"High profit crop for {i % 7 + 1} acres"),
+    'pest': lambda at, i: _by_label(at.text_area, "Describe Symptoms").input(f"Yellow leaves, spots on {i % 5 + 1} plants"),
+    'weather': lambda at, i: _by_label(at.text_input, "Primary Crop Affected").input(["Wheat", "Rice", "Maize"][i % 3]),
+    'soil': lambda at, i: _by_label(at.slider, "Soil pH").set_value(round(5.5 + (i % 6) * 0.4, 1)),
+    'sustainable': lambda at, i: _by_label(at.text_input, "Farm Size").input(f"{i % 4 + 1} Acres"),
+}
+
+
+def _by_label(widgets, label: str):
+    return next(w for w in widgets if w.label == label)
+
+
+def _button(at, label: str):
+    return next(b for b in at.button if b.label == label)
+
+
+def percentile(values: List[float], pct: float) -> float:
+    if not values: return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+class Session:
+    def __init__(self, index: int, timeout: float):
+        from streamlit.testing.v1 import AppTest
+        self.index, self.at = index, AppTest.from_file(APP, default_timeout=timeout)
+        self.timings: Dict[str, List[float]] = {}
+
+    def _timed(self, step: str, action: Callable):
+        started = time.perf_counter()
+        action()
+        self.timings.setdefault(step, []).append(time.perf_counter() - started)
+        if self.at.exception: raise RuntimeError(f"{step}: {self.at.exception[0].message}")
+
+    def onboard(self):
+        at = self.at
+        self._timed('page_hero', at.run)
+        self._timed('page_hero', lambda: _button(at, "🚀 GET STARTED").click().run())
+        self._timed('page_country', lambda: _button(at, "India 🇮🇳").click().run())
+        self._timed('page_state', lambda: at.selectbox[0].select(["Punjab", "Bihar", "Gujarat"][self.index % 3]).run())
+        self._timed('page_state', lambda: _button(at, "CONFIRM LOCATION").click().run())
+        self._timed('page_language', lambda: _button(at, ["Hindi", "English"][self.index % 2]).click().run())
+
+    def submit(self, tool: str):
+        at = self.at
+        self._timed(f'{tool}:nav', lambda: at.button(key=f"nav_{tool}").click().run())
+        TOOLS[tool](at, self.index)
+        self._timed(f'{tool}:submit', lambda: next(b for b in at.button if b.proto.is_form_submitter).click().run())
+
+
+def run_worker(worker: int, args) -> Dict:
+    # AppTest swaps a process-global runtime on every run, so concurrency comes from worker
+    # processes (like app replicas); each worker drives its share of sessions in turn.
+    os.environ.update({'AGSAATHI_FAKE_MODEL': '1', 'AGSAATHI_FAKE_LATENCY': str(args.latency),
+                       'AGSAATHI_FAKE_FAILURE_RATE': str(args.failure_rate), 'AGSAATHI_MODEL_RPM': str(args.rpm),
+                       'AGSAATHI_HISTORY_DB': os.path.join(tempfile.mkdtemp(prefix='agsaathi-bench-'), 'history.db')})
+    sys.path.insert(0, os.path.dirname(APP))
+    import fake_model
+
+    # A throwaway session pays the import and first-compile cost outside the measurements.
+    Session(-1, args.timeout).at.run()
+    base_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    sessions = [Session(i, args.timeout) for i in range(worker, args.sessions, args.concurrency)]
+    calls: Dict[str, int] = {}
+    for s in sessions: s.onboard()
+    for tool in TOOLS:
+        calls_before = fake_model.CALLS['total']
+        for s in sessions: s.submit(tool)
+        calls[tool] = fake_model.CALLS['total'] - calls_before
+    memory = (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - base_rss) * 1024
+
+    timings: Dict[str, List[float]] = {}
+    for s in sessions:
+        for step, values in s.timings.items(): timings.setdefault(step, []).extend(values)
+    return {'sessions': len(sessions), 'calls': calls, 'memory': memory, 'timings': timings, 'failures': fake_model.CALLS['failed']}
+
+
+def run(args) -> Dict:
+    workers = min(args.concurrency, args.sessions)
+    with ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context('spawn')) as pool:
+        results = list(pool.map(run_worker, range(workers), [args] * workers))
+
+    steps: Dict[str, List[float]] = {}
+    for r in results:
+        for step, values in r['timings'].items(): steps.setdefault(step, []).extend(values)
+    report: Dict = {'config': vars(args), 'tools': {}}
+    report['steps'] = {step: {'n': len(v), **{f'p{p}': round(percentile(v, p), 4) for p in (50, 95, 99)}} for step, v in steps.items()}
+    for tool in TOOLS:
+        report['tools'][tool] = {'model_calls_per_submit': round(sum(r['calls'][tool] for r in results) / args.sessions, 3), **report['steps'][f'{tool}:submit']}
+    report['memory_per_session_kb'] = round(sum(r['memory'] for r in results) / args.sessions / 1024, 1)
+    report['model_failures'] = sum(r['failures'] for r in results)
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="AgSaathi offline load & latency benchmark")
+    parser.add_argument('--sessions', type=int, default=50)
+    parser.add_argument('--concurrency', type=int, default=10, help="worker processes driving sessions in parallel")
+    parser.add_argument('--latency', type=float, default=0.5, help="mock model latency in seconds")
+    parser.add_argument('--failure-rate', type=float, default=0.0, help="fraction of mock calls that fail with 503")
+    parser.add_argument('--rpm', type=int, default=100000, help="client rate limit during the run")
+    parser.add_argument('--timeout', type=float, default=120.0, help="per script-run timeout")
+    parser.add_argument('--json', help="also write the report to this file")
+    parser.add_argument('--max-p95', type=float, help="fail if any submit p95 (s) exceeds this")
+    parser.add_argument('--max-calls-per-submit', type=float, help="fail if any tool exceeds this many model calls per submit")
+    args = parser.parse_args()
+
+    report = run(args)
+    print(f"{'step':<22}{'n':>6}{'p50':>10}{'p95':>10}{'p99':>10}")
+    for step, r in report['steps'].items():
+        print(f"{step:<22}{r['n']:>6}{r['p50']:>10.3f}{r['p95']:>10.3f}{r['p99']:>10.3f}")
+    print(f"\n{'tool':<22}{'calls/submit':>14}")
+    for tool, r in report['tools'].items():
+        print(f"{tool:<22}{r['model_calls_per_submit']:>14.3f}")
+    print(f"\nmemory per session: {report['memory_per_session_kb']} KiB | mock failures: {report['model_failures']}")
+    if args.json:
+        with open(args.json, 'w') as f: json.dump(report, f, indent=2)
+
+    failed = [t for t, r in report['tools'].items()
+              if (args.max_p95 is not None and r['p95'] > args.max_p95)
+              or (args.max_calls_per_submit is not None and r['model_calls_per_submit'] > args.max_calls_per_submit)]
+    if failed:
+        print(f"❌ thresholds exceeded for: {', '.join(failed)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+"""
+AgSaathi — offline stand-in for the Gemini model.
+Answers with schema-shaped JSON after a configurable delay so the request pipeline,
+benchmarks and load tests can run without an API key or network access.
+"""
+
+import asyncio
+import json
+import random
+import threading
+import time
+from typing import Dict, Any, List, Optional
+
+from google.api_core import exceptions as google_exceptions
+
+# Process-wide call counter (read by the benchmark harness).
+CALLS = {'total': 0, 'failed': 0}
+_lock = threading.Lock()
+
+
+class FakeUsage:
+    def __init__(self, prompt_tokens: int, response_tokens: int):
+        self.prompt_token_count, self.candidates_token_count = prompt_tokens, response_tokens
+
+
+class FakeResponse:
+    def __init__(self, text: str, prompt_tokens: int = 0, response_chars: Optional[int] = None):
+        self.text = text
+        self.usage_metadata = FakeUsage(prompt_tokens, (len(text) if response_chars is None else response_chars) // 4)
+
+
+class FakeStream:
+    def __init__(self, chunks: List[str], delay: float, prompt_tokens: int):
+        self._chunks, self._delay, self._prompt_tokens = chunks, delay, prompt_tokens
+
+    def __aiter__(self):
+        return self._iterate()
+
+    # Like Gemini, each chunk's usage metadata is cumulative for the stream so far.
+    async def _iterate(self):
+        sent = 0
+        for c in self._chunks:
+            await asyncio.sleep(self._delay)
+            sent += len(c)
+            yield FakeResponse(c, self._prompt_tokens, sent)
+
+    def __iter__(self):
+        sent = 0
+        for c in self._chunks:
+            time.sleep(self._delay)
+            sent += len(c)
+            yield FakeResponse(c, self._prompt_tokens, sent)
+
+
+def sample_from_schema(schema: Optional[Dict], name: str = 'value') -> Any:
+    if not schema: return {}
+    kind = schema.get('type', 'string').lower()
+    if kind == 'object':
+        return {k: sample_from_schema(v, k) for k, v in schema.get('properties', {}).items()}
+    if kind == 'array':
+        return [sample_from_schema(schema.get('items'), name) for _ in range(3)]
+    if kind == 'integer':
+        return random.randint(60, 95)
+    if 'enum' in schema:
+        return random.choice(schema['enum'])
+    return f"Sample {name.replace('_', ' ')}"
+
+
+class FakeModel:
+    def __init__(self, latency: float = 0.5, failure_rate: float = 0.0, chunk_size: int = 40):
+        self.latency, self.failure_rate, self.chunk_size = latency, failure_rate, chunk_size
+
+    def _answer(self, contents, generation_config) -> str:
+        with _lock:
+            CALLS['total'] += 1
+            if random.random() < self.failure_rate:
+                CALLS['failed'] += 1
+                raise google_exceptions.ServiceUnavailable("fake model outage")
+        schema = getattr(generation_config, 'response_schema', None)
+        if isinstance(generation_config, dict): schema = generation_config.get('response_schema')
+        return json.dumps(sample_from_schema(schema), ensure_ascii=False)
+
+    def _chunks(self, text: str) -> List[str]:
+        return [text[i:i + self.chunk_size] for i in range(0, len(text), self.chunk_size)]
+
+    @staticmethod
+    def _prompt_tokens(contents) -> int:
+        # Gemini bills an attached image as a flat 258 tokens, text at roughly 4 chars per token.
+        parts = contents if isinstance(contents, list) else [contents]
+        return sum(len(p) // 4 if isinstance(p, str) else 258 for p in parts)
+
+    def generate_content(self, contents, generation_config=None, stream: bool = False, **kwargs):
+        text = self._answer(contents, generation_config)
+        if stream:
+            chunks = self._chunks(text)
+            return FakeStream(chunks, self.latency / max(len(chunks), 1), self._prompt_tokens(contents))
+        time.sleep(random.uniform(0.5, 1.5) * self.latency)
+        return FakeResponse(text, self._prompt_tokens(contents))
+
+    async def generate_content_async(self, contents, generation_config=None, stream: bool = False, **kwargs):
+        text = self._answer(contents, generation_config)
+        if stream:
+            chunks = self._chunks(text)
+            return FakeStream(chunks, self.latency / max(len(chunks), 1), self._prompt_tokens(contents))
+        await asyncio.sleep(random.uniform(0.5, 1.5) * self.latency)
+        return FakeResponse(text, self._prompt_tokens(contents))
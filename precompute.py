@@ -0,0 +1,106 @@
+"""
+AgSaathi — regional advisory pack builder.
+Generates advisories for the common state × language × option combinations (weather risk
+alerts for each region's top crops, sustainability plans for each practice) and writes them
+to the pack file the app memory-maps at startup. Run it ahead of peak season and on a
+schedule with --refresh, which only regenerates entries that are missing or about to expire.
+
+    python precompute.py --countries India --tasks weather
+    python precompute.py --refresh          # e.g. from cron every 6 hours
+"""
+
+import argparse
+import os
+import sys
+import time
+from typing import Dict, List, Tuple, Any
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import app  # noqa: E402  (bare mode: Streamlit caches work without a running server)
+
+# Crops that dominate each country's weather-alert queries.
+TOP_CROPS = {
+    'India 🇮🇳': ['Wheat', 'Rice', 'Cotton', 'Sugarcane'],
+    'Canada 🇨🇦': ['Wheat', 'Canola', 'Barley'],
+    'Ghana 🇬🇭': ['Cocoa', 'Maize', 'Cassava', 'Yam'],
+}
+
+# Form inputs per task: each enumerable option with the remaining fields at app.PACK_DEFAULTS,
+# the only inputs the app serves from the pack.
+COMBOS = {
+    'weather': lambda country: [{**app.PACK_DEFAULTS['weather'], 'forecast': f, 'crop': c}
+                                for f in app.FORECAST_RISKS for c in TOP_CROPS[country]],
+    'sustainable': lambda country: [{**app.PACK_DEFAULTS['sustainable'], 'practice': p} for p in app.PRACTICES],
+}
+
+
+def combinations(tasks: List[str], countries: List[str]) -> List[Tuple[str, str, str, Dict[str, Any]]]:
+    combos = []
+    for country in countries:
+        geo = app.GEO[country]
+        for task in tasks:
+            for inputs in COMBOS[task](country):
+                combos += [(task, state, lang, inputs) for state in geo['states'] for lang in geo['languages']]
+    return combos
+
+
+def build(args) -> Dict[str, int]:
+    countries = [c for c in app.GEO if any(c.startswith(name) for name in args.countries)] if args.countries else list(app.GEO)
+    old = app.AdvisoryPack(args.out) if args.refresh else None
+    entries, todo, stats = {}, [], {'kept': 0, 'generated': 0, 'failed': 0}
+    for task, state, lang, inputs in combinations(args.tasks, countries):
+        key = app.pack_key(task, inputs, state, lang)
+        # Refresh keeps entries with more than --min-remaining-hours of their pack lifetime left.
+        keep_for = app.PACK_MAX_AGE[task] - args.min_remaining_hours * 3600
+        res = old.get(key, keep_for) if old else None
+        if res is not None:
+            entries[key] = (key, task, old.index[key][2], res); stats['kept'] += 1
+        else:
+            todo.append((key, task, state, lang, inputs))
+
+    # Fan out through the app's model client (rate limit, retries, coalescing), then parse in turn.
+    client = app.get_model()
+    jobs = []
+    for key, task, state, lang, inputs in todo:
+        prompt = app.build_prompt(task, inputs, state, lang)
+        jobs.append((key, task, inputs, prompt, client.submit(prompt, app.structured_config(app.SCHEMAS[task]))))
+    for n, (key, task, inputs, prompt, fut) in enumerate(jobs, 1):
+        try:
+            res, complete = app.finalize_response(task, prompt, fut.result().text)
+        except Exception as e:
+            res, complete = None, False
+            print(f"  ! {task} {key[:10]}: {e}", file=sys.stderr)
+        if res and complete:
+            entries[key] = (key, task, time.time(), {**app.local_fields(task, [inputs])[0], **res}); stats['generated'] += 1
+        else:
+            stats['failed'] += 1
+            if old and key in old.index:  # a stale answer beats none; the app enforces max age
+                entries[key] = (key, task, old.index[key][2], old.get(key))
+        if n % 50 == 0 or n == len(jobs): print(f"  {n}/{len(jobs)} generated")
+
+    if old:  # a refresh limited to some tasks or countries keeps everything else in the pack
+        for key, task, created, res in old.entries():
+            entries.setdefault(key, (key, task, created, res))
+    app.write_pack(args.out, entries.values())
+    return {**stats, 'entries': len(entries)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build the AgSaathi regional advisory pack")
+    parser.add_argument('--tasks', nargs='+', choices=list(COMBOS), default=list(COMBOS))
+    parser.add_argument('--countries', nargs='+', help="country names to include, e.g. India Ghana (default: all)")
+    parser.add_argument('--out', default=app.PACK_PATH, help="pack file to write")
+    parser.add_argument('--refresh', action='store_true', help="keep fresh entries from the existing pack, regenerate the rest")
+    parser.add_argument('--min-remaining-hours', type=float, default=12.0,
+                        help="with --refresh, regenerate entries expiring within this many hours")
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    stats = build(args)
+    print(f"✅ {args.out}: {stats['entries']} entries ({stats['generated']} generated, {stats['kept']} kept, "
+          f"{stats['failed']} failed) in {time.perf_counter() - started:.1f}s")
+    if stats['failed']: sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()